@@ -20,15 +20,51 @@ from rasa_sdk.executor import CollectingDispatcher
 from rasa_sdk.forms import FormValidationAction
 from rasa_sdk.types import DomainDict
 
+from actions.change_feed import CHANGE_FEED, sink_from_env
+from actions.claim_store import ClaimExists, store_from_env
+from actions.number_extraction import parse_amount, parse_integer
+from actions.reference_data import reference_data_from_env
+from actions.responses import renderer_from_env
+from actions.write_pipeline import WritePipeline
+
 
 logger = logging.getLogger(__name__)
 
 MOCK_DATA = json.load(open("actions/mock_data.json", "r"))
 
+# Quote rates are reloaded when the file changes, use REFERENCE_DATA.current() to read them.
+REFERENCE_DATA = reference_data_from_env("actions/mock_data.json")
+
+# Claims and the member address change as users talk to the bot, so they live in the claim store.
+CLAIM_STORE = store_from_env(MOCK_DATA)
+
+# Payments, new claims and address changes are written through the pipeline so concurrent conversations share a
+# commit. Every applied write is published to the change feed and forwarded to the CHANGE_FEED_SINK, if set.
+CHANGE_FEED.start_at(CLAIM_STORE.last_seq)
+WRITE_PIPELINE = WritePipeline(CLAIM_STORE, change_feed=CHANGE_FEED, sink=sink_from_env())
+
+# Set RENDER_RESPONSES=true to fill in domain responses here instead of in Rasa.
+RESPONSE_RENDERER = renderer_from_env("domain.yml")
+
 US_STATES = ["AZ", "AL", "AK", "AR", "CA", "CO", "CT", "DE", "DC", "FL", "GA", "HI", "ID", "IL", "IN", "IA", "KS", "KY",
              "LA", "ME", "MD", "MA", "MI", "MN", "MS", "MO", "MT", "NE", "NV", "NH", "NJ", "NM", "NY", "NC", "ND", "OH",
              "OK", "OR", "PA", "RI", "SC", "SD", "TN", "TX", "UT", "VT", "VA", "WA", "WV", "WI", "WY"]
 
+# New claim IDs are drawn at random; this many are tried before giving up on one that is already taken.
+NEW_CLAIM_ID_ATTEMPTS = 5
+
+
+def utter_response(dispatcher: CollectingDispatcher, tracker: Tracker, template: Text, **kwargs: Any) -> None:
+    """Sends a domain response, rendered here if the response renderer is enabled."""
+    message = None
+    if RESPONSE_RENDERER is not None:
+        message = RESPONSE_RENDERER.render(template, tracker.current_slot_values(), kwargs)
+
+    if message is None:
+        dispatcher.utter_message(template=template, **kwargs)
+    else:
+        dispatcher.utter_message(**message)
+
 
 # Get New Quote Actions
 
@@ -52,7 +88,7 @@ class ActionGetQuote(Action):
         insurance_type = tracker.get_slot("AA_quote_insurance_type")
         n_persons = int(tracker.get_slot("quote_number_persons"))
 
-        baseline_rate = MOCK_DATA["policy_quote"]["insurance_type"][insurance_type]
+        baseline_rate = REFERENCE_DATA.current().quote_rates[insurance_type.lower()]
         final_quote = baseline_rate * n_persons
 
         msg_params = {
@@ -61,7 +97,7 @@ class ActionGetQuote(Action):
             "quote_state": tracker.get_slot("quote_state"),
             "n_persons": n_persons
         }
-        dispatcher.utter_message(template="utter_final_quote", **msg_params)
+        utter_response(dispatcher, tracker, "utter_final_quote", **msg_params)
 
         # Reset the slot values.
         return [SlotSet(slot, None) for slot in slots]
@@ -84,7 +120,7 @@ class ValidateQuoteForm(FormValidationAction):
         """Validates value of 'amount-of-money' slot"""
         insurance_type = tracker.get_slot("AA_quote_insurance_type")
 
-        if insurance_type.lower() not in ["auto", "health", "life", "home"]:
+        if insurance_type.lower() not in REFERENCE_DATA.current().insurance_types:
             dispatcher.utter_message("Must select a valid type of insurance")
             return {"AA_quote_insurance_type": None}
 
@@ -118,15 +154,19 @@ class ValidateQuoteForm(FormValidationAction):
             return {"quote_number_persons": None}
 
         try:
-            int(value)
+            n_persons = int(value)
         except TypeError:
             dispatcher.utter_message(f"Number of persons must be an integer.")
             return {"quote_number_persons": None}
         except ValueError:
-            dispatcher.utter_message("You must answer with a number.")
-            return {"quote_number_persons": None}
-
-        if int(value) <= 0:
+            # No number entity was extracted, so look for the number in the message itself ("3 people").
+            n_persons = parse_integer(tracker.latest_message.get("text"))
+            if n_persons is None:
+                dispatcher.utter_message("You must answer with a number.")
+                return {"quote_number_persons": None}
+            value = str(n_persons)
+
+        if n_persons <= 0:
             dispatcher.utter_message("Number of people on policy must be >= 1.")
             return {"quote_number_persons": None}
 
@@ -164,7 +204,7 @@ class ActionCheckClaimBalance(Action):
     ) -> List[EventType]:
         active_claim = tracker.get_slot("claim_id")
 
-        clm = next((c for c in MOCK_DATA["claims"] if str(c["claim_id"]) == active_claim), None)
+        clm = CLAIM_STORE.get_claim(active_claim)
 
         has_outstanding_balance = clm["claim_balance"] > 0
 
@@ -184,12 +224,13 @@ class AskConfirmAddress(Action):
     def run(
         self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict
     ) -> List[EventType]:
-        # Load the member address from the JSON document.
+        # Load the member address from the claim store.
+        home_address = CLAIM_STORE.get_home_address()
         address_slots = {
-            "address_street": MOCK_DATA["member_info"]["home_address"]["address_street"],
-            "address_city": MOCK_DATA["member_info"]["home_address"]["address_city"],
-            "address_state": MOCK_DATA["member_info"]["home_address"]["address_state"],
-            "address_zip": MOCK_DATA["member_info"]["home_address"]["address_zip"]
+            "address_street": home_address["address_street"],
+            "address_city": home_address["address_city"],
+            "address_state": home_address["address_state"],
+            "address_zip": home_address["address_zip"]
         }
 
         # Build the full address.
@@ -198,7 +239,7 @@ class AskConfirmAddress(Action):
         full_address = "\n".join([address_slots['address_street'], address_line_two])
         address_slots["full_address"] = full_address
 
-        dispatcher.utter_message(template="utter_confirm_address", **address_slots)
+        utter_response(dispatcher, tracker, "utter_confirm_address", **address_slots)
 
         return [SlotSet(k, v) for k, v in address_slots.items()]
 
@@ -269,11 +310,12 @@ class ActionGetAddress(Action):
     def run(
         self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict
     ) -> List[EventType]:
+        home_address = CLAIM_STORE.get_home_address()
         address_slots = {
-            "address_street": MOCK_DATA["member_info"]["home_address"]["address_street"],
-            "address_city": MOCK_DATA["member_info"]["home_address"]["address_city"],
-            "address_state": MOCK_DATA["member_info"]["home_address"]["address_state"],
-            "address_zip": MOCK_DATA["member_info"]["home_address"]["address_zip"]
+            "address_street": home_address["address_street"],
+            "address_city": home_address["address_city"],
+            "address_state": home_address["address_state"],
+            "address_zip": home_address["address_zip"]
         }
 
         # Build the full address.
@@ -292,7 +334,7 @@ class ActionUpdateAddress(Action):
     def name(self) -> Text:
         return "action_update_address"
 
-    def run(
+    async def run(
         self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict
     ) -> List[EventType]:
 
@@ -308,12 +350,12 @@ class ActionUpdateAddress(Action):
         dispatcher.utter_message(full_address)
 
         # Update the address in the data.
-        MOCK_DATA["member_info"]["home_address"] = {
+        await WRITE_PIPELINE.submit("set_home_address", {
             "address_street": address_street,
             "address_city": address_city,
             "address_state": address_state,
             "address_zip": address_zip
-        }
+        })
 
         return [SlotSet("verify_address", None)]
 
@@ -380,7 +422,7 @@ class ActionRecentClaims(Action):
             scroll_response = claims_scroll(claim_page, "next")
 
         for c in scroll_response["claims"]:
-            dispatcher.utter_message(template="utter_claim_detail", **c)
+            utter_response(dispatcher, tracker, "utter_claim_detail", **c)
 
         return [SlotSet("page", scroll_response["page"])]
 
@@ -403,7 +445,7 @@ class ActionClaimStatus(Action):
 
         # Get the claim provided by the user.
         user_clm_id = tracker.get_slot("claim_id")
-        clm = next((c for c in MOCK_DATA["claims"] if str(c["claim_id"]) == user_clm_id), None)
+        clm = CLAIM_STORE.get_claim(user_clm_id)
 
         # Display details about the selected claims.
         if clm:
@@ -414,7 +456,7 @@ class ActionClaimStatus(Action):
                 "claim_balance": f"${str(clm['claim_balance'])}",
                 "claim_status": clm["claim_status"]
             }
-            dispatcher.utter_message(template="utter_claim_detail", **clm_params)
+            utter_response(dispatcher, tracker, "utter_claim_detail", **clm_params)
 
             return [SlotSet("has_outstanding_balance", True)]
 
@@ -439,14 +481,13 @@ class ValidateGetClaimForm(FormValidationAction):
             domain: Dict[Text, Any],
     ) -> Dict[Text, Any]:
         """Checks if the claim ID is valid for the member."""
-        user_claims = MOCK_DATA["claims"]
         claim_id = tracker.get_slot("claim_id")
 
         # Sometimes slot is being double filled.
         if isinstance(claim_id, list):
             claim_id = next(tracker.get_latest_entity_values("claim_id"), None)
 
-        if str(claim_id) not in [clm["claim_id"] for clm in user_claims]:
+        if CLAIM_STORE.get_claim(claim_id) is None:
             dispatcher.utter_message("The Claim ID you entered is not valid. Please check and try again.")
             return {"claim_id": None}
         else:
@@ -552,17 +593,24 @@ class ActionFileNewClaimForm(Action):
     ) -> List[Dict]:
 
         if tracker.get_slot("confirm_file_new_claim") == "yes":
-            # Submit a new claim.
-            claim_id = "NC" + "".join([str(random.randint(0, 9)) for i in range(6)])
-            claim_obj = {
-                "claim_id": claim_id,
-                "claim_balance": tracker.get_slot("claim_amount_submit"),
-                "claim_date": datetime.datetime.strftime(datetime.datetime.today(), "%Y%m%d"),
-                "claim_status": "Pending"
-            }
-
-            MOCK_DATA["claims"].append(claim_obj)
-            dispatcher.utter_message(f"Your claim has been submitted.\n\nFor reference the claim id is: {claim_id}")
+            # Submit a new claim, with a new random ID if the one drawn is already taken.
+            for _ in range(NEW_CLAIM_ID_ATTEMPTS):
+                claim_id = "NC" + "".join([str(random.randint(0, 9)) for i in range(6)])
+                claim_obj = {
+                    "claim_id": claim_id,
+                    "claim_balance": tracker.get_slot("claim_amount_submit"),
+                    "claim_date": int(datetime.datetime.strftime(datetime.datetime.today(), "%Y%m%d")),
+                    "claim_status": "Pending"
+                }
+                try:
+                    await WRITE_PIPELINE.submit("add_claim", claim_obj)
+                except ClaimExists:
+                    logger.info(f"New claim ID '{claim_id}' is already taken, drawing another one.")
+                    continue
+                dispatcher.utter_message(f"Your claim has been submitted.\n\nFor reference the claim id is: {claim_id}")
+                break
+            else:
+                dispatcher.utter_message("Sorry, your claim couldn't be submitted. Please try again.")
         else:
             dispatcher.utter_message("Ok. Submitting your claim has been canceled.")
 
@@ -588,11 +636,13 @@ class ValidateFileNewClaimForm(FormValidationAction):
     ) -> Dict[Text, Any]:
         """Validate insurance type value."""
 
-        if slot_value.lower() not in ["health", "auto", "life", "home"]:
+        insurance_types = REFERENCE_DATA.current().insurance_types
+
+        if slot_value.lower() not in insurance_types:
             dispatcher.utter_message("I can only provide quotes for home, health, life, or home insurance. "
                                      "Please choose one of those options.")
             return {"AA_quote_insurance_type": None}
-        elif slot_value.lower() in ["health", "auto", "life", "home"]:
+        elif slot_value.lower() in insurance_types:
             return {"AA_quote_insurance_type": slot_value}
 
         return {"AA_quote_insurance_type": None}
@@ -609,8 +659,11 @@ class ValidateFileNewClaimForm(FormValidationAction):
         try:
             submitted_amount = float(value)
         except ValueError:
-            dispatcher.utter_message("You must submit a numeric value for the claim amount.")
-            return {"claim_amount_submit": None}
+            # No amount entity was extracted, so look for the amount in the message itself ("$1,200.50").
+            submitted_amount = parse_amount(tracker.latest_message.get("text"))
+            if submitted_amount is None:
+                dispatcher.utter_message("You must submit a numeric value for the claim amount.")
+                return {"claim_amount_submit": None}
 
         # Submitted amount must be greater than 0.
         try:
@@ -681,8 +734,8 @@ class ActionAskScrollClaims(Action):
         elif scroll_response["page"] == 0:
             msg_template = "utter_scroll_status_next"
 
-        dispatcher.utter_message(template="utter_claim_detail", **scroll_response["claims"])
-        dispatcher.utter_message(template=msg_template)
+        utter_response(dispatcher, tracker, "utter_claim_detail", **scroll_response["claims"])
+        utter_response(dispatcher, tracker, msg_template)
 
         return [SlotSet("page", scroll_response["page"]),
                 SlotSet("scroll_active_claim", scroll_response["claims"]["claim_id"])]
@@ -737,7 +790,7 @@ class ActionPayClaim(Action):
         claim_balance = tracker.get_slot("claim_balance")
 
         if claim_balance == 0:
-            dispatcher.utter_message(template="utter_zero_balance")
+            utter_response(dispatcher, tracker, "utter_zero_balance")
             reset_slots.append("claim_id")
             return [SlotSet(slot, None) for slot in reset_slots]
 
@@ -746,11 +799,9 @@ class ActionPayClaim(Action):
             "amount_to_pay": amount_to_pay,
             "claim_balance": claim_balance - amount_to_pay
         }
-        for c in MOCK_DATA["claims"]:
-            if c["claim_id"] == user_clm_id:
-                c.update({"claim_balance": claim_balance - amount_to_pay})
+        await WRITE_PIPELINE.submit("update_claim_balance", user_clm_id, claim_balance - amount_to_pay)
 
-        dispatcher.utter_message(template="utter_claim_payment_success", **msg_params)
+        utter_response(dispatcher, tracker, "utter_claim_payment_success", **msg_params)
 
         return [SlotSet(slot, None) for slot in reset_slots]
 
@@ -767,7 +818,7 @@ class ActionCancelPayment(Action):
             tracker: Tracker,
             domain: Dict[Text, Any],
     ) -> List[Dict]:
-        dispatcher.utter_message(template="utter_cancel_payment")
+        utter_response(dispatcher, tracker, "utter_cancel_payment")
 
         reset_slots = ["claim_balance", "claim_pay_amount", "claim_id", "confirm_payment", "amount-of-money", "number"]
         return [SlotSet(slot, None) for slot in reset_slots]
@@ -814,6 +865,9 @@ class ValidatePayClaimForm(FormValidationAction):
             except StopIteration:
                 pass
 
+            # No entities were extracted, so look for an amount in the message itself.
+            amount_to_pay = parse_amount(last_message.get("text"))
+
             return {"amount-of-money": amount_to_pay}
 
     def validate_claim_id(
@@ -824,17 +878,16 @@ class ValidatePayClaimForm(FormValidationAction):
             domain: DomainDict,
     ) -> Dict[Text, Any]:
         """Checks if the claim ID is valid for the member."""
-        user_claims = MOCK_DATA["claims"]
         claim_id = tracker.get_slot("claim_id")
 
         if isinstance(claim_id, list):
             claim_id = claim_id[-1]
 
-        if str(claim_id) not in [clm["claim_id"] for clm in user_claims]:
+        clm = CLAIM_STORE.get_claim(claim_id)
+        if clm is None:
             dispatcher.utter_message("The Claim ID you entered is not valid. Please check and try again.")
             return {"claim_id": None}
 
-        clm = next((c for c in MOCK_DATA["claims"] if str(c["claim_id"]) == claim_id), None)
         if clm["claim_balance"] == 0:
             dispatcher.utter_message(f"Claim {claim_id} is fully paid.")
 
@@ -850,7 +903,7 @@ class ValidatePayClaimForm(FormValidationAction):
         if tracker.slots.get("requested_slot") == "claim_pay_amount":
             claim_id = tracker.get_slot("claim_id")
             payment_amount = tracker.get_slot("claim_pay_amount")
-            clm = next((c for c in MOCK_DATA["claims"] if str(c["claim_id"]) == claim_id), None)
+            clm = CLAIM_STORE.get_claim(claim_id)
 
             # Check that a valid number is provided.
             try:
@@ -858,6 +911,12 @@ class ValidatePayClaimForm(FormValidationAction):
             except TypeError:
                 dispatcher.utter_message("Please enter a valid number as your payment amount.")
                 return {"claim_pay_amount": None}
+            except ValueError:
+                # No amount entity was extracted, so look for the amount in the message itself.
+                payment_amount = parse_amount(tracker.latest_message.get("text"))
+                if payment_amount is None:
+                    dispatcher.utter_message("Please enter a valid number as your payment amount.")
+                    return {"claim_pay_amount": None}
 
             # Check that the payment is greater than zero.
             if payment_amount <= 0:
@@ -890,7 +949,7 @@ def claims_scroll(curr_page, scroll_status):
             curr_page -= 1
 
     # Get claims on the page.
-    page_claims = MOCK_DATA["claims"][curr_page]
+    page_claims = CLAIM_STORE.claim_at(curr_page)
     clm_params = {
         "claim_date": str(datetime.datetime.strptime(str(page_claims["claim_date"]), "%Y%m%d").date()),
         "claim_id": page_claims["claim_id"],
@@ -900,5 +959,5 @@ def claims_scroll(curr_page, scroll_status):
 
     return {"page": curr_page,
             "claims": clm_params,
-            "is_last_page": curr_page + 1 >= len(MOCK_DATA["claims"])}
+            "is_last_page": curr_page + 1 >= CLAIM_STORE.count_claims()}
 
@@ -0,0 +1,240 @@
+"""Admission control for action calls.
+
+Each worker runs at most `max_in_flight` action calls at once. Calls over that limit wait in a queue in priority order:
+calls that write to the claim store (paying a claim, filing a claim, changing the address) are admitted before
+everything else, so a burst of claim listings can't hold up payments. Calls for the same conversation run one at a
+time, in the order they arrived.
+
+Nothing waits for long. A call is turned away with a `Retry-After` hint when the queue is full or when it couldn't be
+admitted within `max_wait` seconds: with 503 when the worker is overloaded, and with 429 when the conversation already
+has too many calls waiting.
+"""
+import os
+import heapq
+import asyncio
+import itertools
+from collections import deque
+from typing import Dict, Text, Any, List, Optional
+
+from actions.metrics import REGISTRY
+
+
+WRITE = "write"
+READ = "read"
+
+# Lower ranks are admitted first.
+PRIORITY_RANKS = {WRITE: 0, READ: 1}
+
+WRITE_ACTIONS = {"action_pay_claim", "action_file_new_claim_form", "action_update_address"}
+
+IN_FLIGHT = REGISTRY.gauge("admission_in_flight", "Action calls currently running.")
+QUEUE_DEPTH = REGISTRY.gauge("admission_queue_depth", "Action calls waiting to be admitted.")
+REJECTED = REGISTRY.counter("admission_rejected_total", "Action calls turned away by admission control.")
+WAIT_TIME = REGISTRY.histogram("admission_wait_seconds", "Time action calls waited to be admitted.",
+                               [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5])
+
+
+class AdmissionRejected(Exception):
+    """An action call was turned away. `status` is the HTTP status to answer with."""
+
+    def __init__(self, status: int, reason: Text, retry_after: int, message: Text) -> None:
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+        self.message = message
+        super().__init__(message)
+
+
+class _Conversation:
+    """Calls of one conversation: whether one is running and the ones waiting for it."""
+
+    __slots__ = ("busy", "waiters")
+
+    def __init__(self) -> None:
+        self.busy = False
+        self.waiters: deque = deque()
+
+
+async def _wait(future: asyncio.Future, timeout: float) -> bool:
+    """Waits for `future` to be resolved without cancelling it on timeout. Returns whether it was resolved."""
+    if timeout > 0:
+        await asyncio.wait([future], timeout=timeout)
+    return future.done() and not future.cancelled()
+
+
+class AdmissionController:
+    """Limits the number of concurrent action calls and queues the rest by priority."""
+
+    def __init__(
+        self,
+        max_in_flight: int = 64,
+        max_queue: int = 256,
+        max_wait: float = 2.0,
+        max_conversation_queue: int = 4,
+        retry_after: int = 1,
+        write_actions=WRITE_ACTIONS,
+    ) -> None:
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_conversation_queue = max_conversation_queue
+        self.retry_after = retry_after
+        self.write_actions = frozenset(write_actions)
+        self.in_flight = 0
+        self._queue: List[List[Any]] = []
+        self._order = itertools.count()
+        self._conversations: Dict[Text, _Conversation] = {}
+
+    def priority(self, action_name: Text) -> Text:
+        return WRITE if action_name in self.write_actions else READ
+
+    def _reject(self, status: int, reason: Text, priority: Text, message: Text) -> AdmissionRejected:
+        REJECTED.inc(reason=reason, priority=priority)
+        return AdmissionRejected(status, reason, self.retry_after, message)
+
+    def admit(self, action_name: Text, sender_id: Text) -> "_Admission":
+        """Returns an async context manager that waits until the call may run and holds its slot for the duration of
+        the block.
+
+        Entering it raises `AdmissionRejected` if the call can't be admitted in time.
+        """
+        return _Admission(self, action_name, sender_id)
+
+    async def _enter(self, action_name: Text, sender_id: Text) -> None:
+        loop = asyncio.get_event_loop()
+        priority = self.priority(action_name)
+        started = loop.time()
+        deadline = started + self.max_wait
+
+        await self._enter_conversation(sender_id, priority, deadline)
+        try:
+            await self._acquire_slot(priority, deadline)
+        except BaseException:
+            self._leave_conversation(sender_id)
+            raise
+        WAIT_TIME.observe(loop.time() - started)
+
+    def _exit(self, sender_id: Text) -> None:
+        self._release_slot()
+        self._leave_conversation(sender_id)
+
+    async def _enter_conversation(self, sender_id: Text, priority: Text, deadline: float) -> None:
+        conversation = self._conversations.get(sender_id)
+        if conversation is None:
+            conversation = self._conversations[sender_id] = _Conversation()
+        if not conversation.busy:
+            conversation.busy = True
+            return
+
+        if len(conversation.waiters) >= self.max_conversation_queue:
+            raise self._reject(429, "conversation_queue_full", priority,
+                               "Too many action calls waiting for this conversation.")
+
+        future = asyncio.get_event_loop().create_future()
+        conversation.waiters.append(future)
+        try:
+            admitted = await _wait(future, deadline - asyncio.get_event_loop().time())
+        except asyncio.CancelledError:
+            admitted = future.done() and not future.cancelled()
+            if admitted:
+                self._leave_conversation(sender_id)
+            else:
+                self._abandon_conversation(sender_id, conversation, future)
+            raise
+
+        if not admitted:
+            self._abandon_conversation(sender_id, conversation, future)
+            raise self._reject(429, "conversation_wait_timeout", priority,
+                               "Timed out waiting for the conversation's previous action call.")
+
+    def _abandon_conversation(self, sender_id: Text, conversation: _Conversation, future: asyncio.Future) -> None:
+        future.cancel()
+        conversation.waiters.remove(future)
+        if not conversation.busy and not conversation.waiters:
+            del self._conversations[sender_id]
+
+    def _leave_conversation(self, sender_id: Text) -> None:
+        """Hands the conversation to its next waiting call, if there is one."""
+        conversation = self._conversations[sender_id]
+        while conversation.waiters:
+            future = conversation.waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        del self._conversations[sender_id]
+
+    async def _acquire_slot(self, priority: Text, deadline: float) -> None:
+        if self.in_flight < self.max_in_flight and not self._queue:
+            self.in_flight += 1
+            IN_FLIGHT.set(self.in_flight)
+            return
+
+        if len(self._queue) >= self.max_queue:
+            raise self._reject(503, "queue_full", priority, "Too many action calls waiting to run.")
+
+        future = asyncio.get_event_loop().create_future()
+        entry = [PRIORITY_RANKS[priority], next(self._order), future, priority]
+        heapq.heappush(self._queue, entry)
+        QUEUE_DEPTH.inc(priority=priority)
+        try:
+            admitted = await _wait(future, deadline - asyncio.get_event_loop().time())
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release_slot()
+            else:
+                self._dequeue(entry)
+            raise
+
+        if not admitted:
+            self._dequeue(entry)
+            raise self._reject(503, "wait_timeout", priority, "Timed out waiting for the server to run the action.")
+
+    def _dequeue(self, entry: List[Any]) -> None:
+        entry[2].cancel()
+        self._queue.remove(entry)
+        heapq.heapify(self._queue)
+        QUEUE_DEPTH.dec(priority=entry[3])
+
+    def _release_slot(self) -> None:
+        """Hands the slot to the highest priority waiting call, or frees it."""
+        if self._queue:
+            _, _, future, priority = heapq.heappop(self._queue)
+            QUEUE_DEPTH.dec(priority=priority)
+            future.set_result(None)
+            return
+
+        self.in_flight -= 1
+        IN_FLIGHT.set(self.in_flight)
+
+
+class _Admission:
+    __slots__ = ("controller", "action_name", "sender_id")
+
+    def __init__(self, controller: AdmissionController, action_name: Text, sender_id: Text) -> None:
+        self.controller = controller
+        self.action_name = action_name
+        self.sender_id = sender_id
+
+    async def __aenter__(self) -> None:
+        await self.controller._enter(self.action_name, self.sender_id)
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.controller._exit(self.sender_id)
+
+
+def admission_from_env() -> Optional[AdmissionController]:
+    """Builds the admission controller configured by the `ADMISSION_*` environment variables.
+
+    Admission control is off when `ADMISSION_MAX_IN_FLIGHT` is 0.
+    """
+    max_in_flight = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", 64))
+    if max_in_flight <= 0:
+        return None
+
+    return AdmissionController(
+        max_in_flight=max_in_flight,
+        max_queue=int(os.environ.get("ADMISSION_MAX_QUEUE", 256)),
+        max_wait=float(os.environ.get("ADMISSION_MAX_WAIT", 2.0)),
+        max_conversation_queue=int(os.environ.get("ADMISSION_MAX_CONVERSATION_QUEUE", 4)),
+        retry_after=int(os.environ.get("ADMISSION_RETRY_AFTER", 1)),
+    )
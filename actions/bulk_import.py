@@ -0,0 +1,225 @@
+"""Streaming import of claims from NDJSON or CSV extracts into the SQLite claim store.
+
+    python -m actions.bulk_import claims.ndjson more-claims.csv.gz --claim-store claims.db
+
+Files are read one row at a time and written in batches of `--batch-size` rows, one transaction per batch, so memory
+use doesn't grow with the size of the extract. Rows that fail validation are reported and skipped. A row whose claim ID
+is already in the store updates that claim. Each batch gets one change sequence number, so imported claims show up
+when looking for claims changed since a given sequence.
+"""
+import os
+import re
+import csv
+import sys
+import gzip
+import json
+import math
+import time
+import datetime
+from typing import Dict, Text, Any, List, Tuple, Iterator, Optional, Callable
+
+from actions.claim_store import CLAIM_FIELDS, CLAIM_STATUSES, SQLiteClaimStore
+
+
+CLAIM_ID_PATTERN = re.compile(r"[A-Z]{1,2}\d{5,7}")
+FORMATS = {".ndjson": "ndjson", ".jsonl": "ndjson", ".json": "ndjson", ".csv": "csv"}
+
+# Rejected rows printed before only counting them.
+MAX_REPORTED_ERRORS = 20
+
+
+def detect_format(path: Text) -> Text:
+    """Guesses the format of a file from its extension, ignoring a trailing `.gz`."""
+    name = path[:-len(".gz")] if path.endswith(".gz") else path
+    fmt = FORMATS.get(os.path.splitext(name)[1].lower())
+    if fmt is None:
+        raise ValueError(f"Can't tell the format of '{path}', use --format.")
+    return fmt
+
+
+def _integer(value: Any) -> int:
+    if isinstance(value, bool):
+        raise ValueError(f"expected an integer, got {value!r}")
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    raise ValueError(f"expected an integer, got {value!r}")
+
+
+def claim_row(record: Dict[Text, Any]) -> Tuple[Text, int, float, Text]:
+    """Validates a claim record and turns it into a `(claim_id, claim_date, claim_balance, claim_status)` row.
+
+    Raises `ValueError` describing the first problem found.
+    """
+    if not isinstance(record, dict):
+        raise ValueError("expected an object")
+    missing = [f for f in CLAIM_FIELDS if record.get(f) in (None, "")]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+
+    claim_id = record["claim_id"]
+    if not isinstance(claim_id, str) or not CLAIM_ID_PATTERN.fullmatch(claim_id):
+        raise ValueError(f"invalid claim_id {claim_id!r}")
+
+    try:
+        claim_date = _integer(record["claim_date"])
+        datetime.date(claim_date // 10000, claim_date // 100 % 100, claim_date % 100)
+    except ValueError as e:
+        raise ValueError(f"invalid claim_date {record['claim_date']!r}, expected YYYYMMDD") from e
+
+    claim_balance = record["claim_balance"]
+    try:
+        if isinstance(claim_balance, bool):
+            raise ValueError
+        claim_balance = float(claim_balance)
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid claim_balance {record['claim_balance']!r}") from None
+    if not math.isfinite(claim_balance) or claim_balance < 0:
+        raise ValueError(f"invalid claim_balance {record['claim_balance']!r}")
+
+    claim_status = record["claim_status"]
+    if claim_status not in CLAIM_STATUSES:
+        raise ValueError(f"unknown claim_status {claim_status!r}, expected one of {', '.join(sorted(CLAIM_STATUSES))}")
+
+    return claim_id, claim_date, claim_balance, claim_status
+
+
+def read_records(f, fmt: Text) -> Iterator[Tuple[int, Any, Callable[[Any], Dict[Text, Any]]]]:
+    """Yields `(line_number, raw_record, decode)` for each record in an open text file.
+
+    Decoding is left to the caller so a malformed line can be reported as a rejected row.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(f)
+        for record in reader:
+            yield reader.line_num, record, dict
+    elif fmt == "ndjson":
+        for line_number, line in enumerate(f, 1):
+            if line.strip():
+                yield line_number, line, json.loads
+    else:
+        raise ValueError(f"Unknown format '{fmt}'.")
+
+
+def open_text(path: Text):
+    if path == "-":
+        return sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+class ClaimImporter:
+    """Writes validated claims to the store in batches and keeps count of what happened."""
+
+    def __init__(
+        self,
+        store: SQLiteClaimStore,
+        batch_size: int = 50000,
+        max_errors: Optional[int] = 1000,
+        progress_interval: float = 5.0,
+        out=sys.stderr,
+    ) -> None:
+        self.store = store
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.progress_interval = progress_interval
+        self.out = out
+        self.imported = 0
+        self.rejected = 0
+        self._batch: List[Tuple[Text, int, float, Text]] = []
+        self._started = time.perf_counter()
+        self._next_report = self._started + progress_interval
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self._started
+        return self.imported / elapsed if elapsed > 0 else 0.0
+
+    def import_file(self, path: Text, fmt: Optional[Text] = None) -> None:
+        """Imports every valid claim in a file. Raises `ValueError` once more than `max_errors` rows were rejected."""
+        fmt = fmt or detect_format(path)
+        f = open_text(path)
+        try:
+            for line_number, raw, decode in read_records(f, fmt):
+                try:
+                    self._batch.append(claim_row(decode(raw)))
+                except (ValueError, TypeError) as e:
+                    self._reject(path, line_number, e)
+                    continue
+                if len(self._batch) >= self.batch_size:
+                    self.flush()
+        finally:
+            if f is not sys.stdin:
+                f.close()
+        self.flush()
+
+    def _reject(self, path: Text, line_number: int, error: Exception) -> None:
+        self.rejected += 1
+        if self.rejected <= MAX_REPORTED_ERRORS:
+            print(f"{path}:{line_number}: {error}", file=self.out)
+        elif self.rejected == MAX_REPORTED_ERRORS + 1:
+            print("Not reporting any more rejected rows.", file=self.out)
+        if self.max_errors is not None and self.rejected > self.max_errors:
+            raise ValueError(f"Stopped after {self.rejected} rejected rows.")
+
+    def flush(self) -> None:
+        if not self._batch:
+            return
+        self.store.import_claims(self._batch)
+        self.imported += len(self._batch)
+        self._batch = []
+
+        now = time.perf_counter()
+        if now >= self._next_report:
+            self._next_report = now + self.progress_interval
+            print(f"{self.imported:,} claims imported, {self.rate:,.0f} rows/s", file=self.out)
+
+    def summary(self) -> Text:
+        elapsed = time.perf_counter() - self._started
+        return (f"Imported {self.imported:,} claims in {elapsed:.1f}s ({self.rate:,.0f} rows/s), "
+                f"rejected {self.rejected:,} rows.")
+
+
+def main(args=None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Imports claims from NDJSON or CSV files into the claim store.")
+    parser.add_argument("paths", nargs="+", help="Files to import, optionally gzipped. Use - to read stdin.")
+    parser.add_argument("--claim-store", default=os.environ.get("CLAIM_STORE_PATH"),
+                        required="CLAIM_STORE_PATH" not in os.environ,
+                        help="SQLite claim store to import into (CLAIM_STORE_PATH).")
+    parser.add_argument("--format", choices=sorted(set(FORMATS.values())),
+                        help="Format of the files. Guessed from the file extension by default.")
+    parser.add_argument("--batch-size", type=int, default=50000, help="Claims written per transaction.")
+    parser.add_argument("--max-errors", type=int, default=1000,
+                        help="Stop after this many rejected rows. Use -1 to never stop.")
+    parser.add_argument("--progress-interval", type=float, default=5.0, help="Seconds between progress reports.")
+    parsed = parser.parse_args(args)
+
+    if "-" in parsed.paths and not parsed.format:
+        parser.error("--format is needed to read from stdin.")
+
+    store = SQLiteClaimStore(parsed.claim_store)
+    store.initialize()
+    importer = ClaimImporter(
+        store,
+        batch_size=parsed.batch_size,
+        max_errors=parsed.max_errors if parsed.max_errors >= 0 else None,
+        progress_interval=parsed.progress_interval,
+    )
+
+    try:
+        for path in parsed.paths:
+            importer.import_file(path, parsed.format)
+    except (OSError, ValueError, csv.Error) as e:
+        print(f"Import failed: {e}", file=sys.stderr)
+        print(importer.summary(), file=sys.stderr)
+        sys.exit(1)
+
+    print(importer.summary(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""An ordered, in-process feed of claim and address changes.
+
+The write pipeline publishes the change record of every write it applies (see `actions.claim_store`), in sequence
+order. Subscribers consume the feed asynchronously and can resume from the last sequence number they saw, as long as
+that change is still in the bounded buffer. A subscriber that falls further behind gets a `ChangeFeedGap` and has to
+resync from the claim store.
+
+Each worker publishes the changes it applied itself. Sequence numbers are unique and only go up across workers sharing
+a SQLite store, but with several workers a sink gets each worker's changes in order, interleaved with the other
+workers' changes rather than in one global order. Consumers that need a single order should sort by sequence number,
+or read the claim store with `python -m actions.export_claims --changed-since`.
+
+Sinks forward the feed to other systems. `FileSink` appends NDJSON to a local file and `SocketSink` streams NDJSON to a
+Unix or TCP socket, which is enough to try the feed out without a real event broker, e.g. with `nc -lk 9999` and
+`CHANGE_FEED_SINK=tcp:localhost:9999`.
+"""
+import os
+import json
+import asyncio
+import logging
+from bisect import bisect_right
+from typing import Dict, Text, Any, List, Optional, AsyncIterator
+
+from actions.metrics import REGISTRY
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BUFFER = 10000
+
+PUBLISHED = REGISTRY.counter("change_feed_published_total", "Changes published to the change feed.")
+SINK_ERRORS = REGISTRY.counter("change_feed_sink_errors_total", "Failed attempts to write changes to a sink.")
+
+
+class ChangeFeedGap(Exception):
+    """The changes a subscriber asked for are no longer buffered."""
+
+    def __init__(self, from_seq: int, oldest_seq: int) -> None:
+        self.from_seq = from_seq
+        self.oldest_seq = oldest_seq
+        super().__init__(f"Changes after {from_seq} are no longer buffered, "
+                         f"the oldest buffered change is {oldest_seq}.")
+
+
+class ChangeFeed:
+    """Buffers the latest changes and hands them to subscribers in sequence order."""
+
+    def __init__(self, max_buffer: int = DEFAULT_MAX_BUFFER) -> None:
+        self.max_buffer = max_buffer
+        self._changes: List[Dict[Text, Any]] = []
+        self._seqs: List[int] = []
+        # Highest sequence number that has been dropped from the buffer.
+        self._dropped_seq = 0
+        self._waiters: List[asyncio.Future] = []
+
+    @property
+    def last_seq(self) -> int:
+        return self._seqs[-1] if self._seqs else self._dropped_seq
+
+    def start_at(self, seq: int) -> None:
+        """Starts the feed after `seq`, the claim store's sequence number before anything was published."""
+        if self._seqs:
+            raise ValueError("Can't move the start of a feed that has changes.")
+        self._dropped_seq = seq
+
+    def publish(self, change: Dict[Text, Any]) -> None:
+        """Adds a change to the feed. Changes must be published in sequence order."""
+        if change["seq"] <= self.last_seq:
+            raise ValueError(f"Change {change['seq']} is out of order, the feed is at {self.last_seq}.")
+
+        self._changes.append(change)
+        self._seqs.append(change["seq"])
+        PUBLISHED.inc(type=change["type"])
+
+        # Trim in chunks so publishing stays cheap.
+        if len(self._changes) > 2 * self.max_buffer:
+            drop = len(self._changes) - self.max_buffer
+            self._dropped_seq = self._seqs[drop - 1]
+            del self._changes[:drop]
+            del self._seqs[:drop]
+
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def changes_since(self, seq: int) -> List[Dict[Text, Any]]:
+        """Returns the buffered changes after `seq`. Raises `ChangeFeedGap` if some of them were dropped."""
+        if seq < self._dropped_seq:
+            raise ChangeFeedGap(seq, self._seqs[0] if self._seqs else self._dropped_seq + 1)
+        return self._changes[bisect_right(self._seqs, seq):]
+
+    async def subscribe(self, from_seq: Optional[int] = None) -> AsyncIterator[Dict[Text, Any]]:
+        """Yields the changes after `from_seq`, waiting for new ones as they are published.
+
+        Without `from_seq` only changes published from now on are yielded.
+        """
+        seq = self.last_seq if from_seq is None else from_seq
+        while True:
+            changes = self.changes_since(seq)
+            if not changes:
+                waiter = asyncio.get_event_loop().create_future()
+                self._waiters.append(waiter)
+                await waiter
+                continue
+
+            for change in changes:
+                yield change
+                seq = change["seq"]
+
+
+class FileSink:
+    """Appends changes to a file as NDJSON."""
+
+    def __init__(self, path: Text) -> None:
+        self.path = path
+
+    def last_seq(self) -> int:
+        """Sequence number of the last change in the file, so a restarted sink can resume after it."""
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - 65536))
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return 0
+
+        for line in reversed(lines):
+            try:
+                return json.loads(line)["seq"]
+            except (ValueError, KeyError, TypeError):
+                continue
+        return 0
+
+    async def write(self, change: Dict[Text, Any]) -> None:
+        # One append per change, so lines from several workers writing to the same file don't interleave.
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, (json.dumps(change) + "\n").encode("utf-8"))
+        finally:
+            os.close(fd)
+
+    async def close(self) -> None:
+        pass
+
+
+class SocketSink:
+    """Streams changes as NDJSON to a Unix socket (`unix:/path`) or a TCP socket (`tcp:host:port`)."""
+
+    def __init__(self, address: Text) -> None:
+        self.address = address
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    def last_seq(self) -> int:
+        return 0
+
+    async def _connect(self) -> asyncio.StreamWriter:
+        kind, _, target = self.address.partition(":")
+        if kind == "unix":
+            _, writer = await asyncio.open_unix_connection(target)
+        elif kind == "tcp":
+            host, _, port = target.rpartition(":")
+            _, writer = await asyncio.open_connection(host, int(port))
+        else:
+            raise ValueError(f"Unknown socket address '{self.address}', use unix:/path or tcp:host:port.")
+        return writer
+
+    async def write(self, change: Dict[Text, Any]) -> None:
+        if self._writer is None:
+            self._writer = await self._connect()
+        try:
+            self._writer.write((json.dumps(change) + "\n").encode("utf-8"))
+            await self._writer.drain()
+        except (ConnectionError, OSError):
+            await self.close()
+            raise
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+async def run_sink(feed: ChangeFeed, sink, retry_delay: float = 1.0, start_seq: Optional[int] = None) -> None:
+    """Forwards the feed to a sink, resuming after the last change the sink has seen.
+
+    A sink that hasn't seen any changes starts after `start_seq`, by default wherever the feed is when this runs.
+    """
+    seq = max(sink.last_seq(), 0) or (feed.last_seq if start_seq is None else start_seq)
+    if seq > feed.last_seq:
+        # The sink has seen changes the store doesn't know about, e.g. from before a restart of the in-memory store,
+        # whose sequence starts again at 0. Waiting for the store to catch up would silently drop the new changes.
+        logger.warning(f"Change feed sink already has changes up to {seq}, but the claim store is at {feed.last_seq}. "
+                       f"Its sequence numbers were reset, forwarding the changes after {feed.last_seq}.")
+        seq = feed.last_seq
+    try:
+        while True:
+            try:
+                async for change in feed.subscribe(seq):
+                    await sink.write(change)
+                    seq = change["seq"]
+            except ChangeFeedGap as e:
+                logger.warning(f"Change feed sink fell behind, skipping to {e.oldest_seq}: {e}")
+                seq = e.oldest_seq - 1
+            except (ConnectionError, OSError) as e:
+                SINK_ERRORS.inc()
+                logger.warning(f"Could not write to change feed sink, retrying in {retry_delay}s: {e}")
+                await asyncio.sleep(retry_delay)
+    finally:
+        await sink.close()
+
+
+def sink_from_env():
+    """Builds the sink configured by `CHANGE_FEED_SINK` (`file:/path`, `unix:/path` or `tcp:host:port`), if any."""
+    target = os.environ.get("CHANGE_FEED_SINK")
+    if not target:
+        return None
+    if target.startswith("file:"):
+        return FileSink(target[len("file:"):])
+    return SocketSink(target)
+
+
+CHANGE_FEED = ChangeFeed(int(os.environ.get("CHANGE_FEED_MAX_BUFFER", DEFAULT_MAX_BUFFER)))
@@ -0,0 +1,420 @@
+"""Storage for mutable member state (claims and the member's home address).
+
+Every write gets a sequence number from the store and returns a change record describing it:
+
+    {"seq": 7, "type": "claim_updated", "timestamp": 1617225600.0, "claim_id": "AB234567", "data": {...}}
+
+The sequence numbers only go up, also across processes sharing a SQLite store, so they can be used to find what
+changed since a given point.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Text, Any, List, Optional, Tuple, Iterable, Iterator
+
+
+CLAIM_FIELDS = ["claim_id", "claim_date", "claim_balance", "claim_status"]
+ADDRESS_FIELDS = ["address_street", "address_city", "address_state", "address_zip"]
+CLAIM_STATUSES = {"Submitted", "Pending", "Final"}
+
+CLAIM_CREATED = "claim_created"
+CLAIM_UPDATED = "claim_updated"
+ADDRESS_UPDATED = "address_updated"
+
+# Listing index of a claim added to the SQLite store, looked up in the `claims_listing` index.
+_NEXT_LISTING = "(SELECT COALESCE(MAX(listing) + 1, 0) FROM claims)"
+
+# Store methods that can be queued on the write pipeline.
+WRITE_OPERATIONS = {"update_claim_balance", "add_claim", "set_home_address"}
+
+
+class ClaimExists(ValueError):
+    """A new claim was given the ID of a claim that is already in the store."""
+
+    def __init__(self, claim_id: Text) -> None:
+        self.claim_id = claim_id
+        super().__init__(f"Claim '{claim_id}' already exists.")
+
+
+def _change(seq: int, change_type: Text, data: Dict[Text, Any], claim_id: Optional[Text] = None) -> Dict[Text, Any]:
+    change = {"seq": seq, "type": change_type, "timestamp": time.time(), "data": data}
+    if claim_id is not None:
+        change["claim_id"] = claim_id
+    return change
+
+
+def _matches(
+    claim: Dict[Text, Any],
+    statuses: Optional[Iterable[Text]],
+    date_from: Optional[int],
+    date_to: Optional[int],
+) -> bool:
+    return ((statuses is None or claim["claim_status"] in statuses)
+            and (date_from is None or claim["claim_date"] >= date_from)
+            and (date_to is None or claim["claim_date"] <= date_to))
+
+
+def _apply(store, mutations: List[Tuple[Text, Tuple]], errors, conn: Optional[sqlite3.Connection] = None) -> List[Any]:
+    """Applies each mutation, recording the ones that fail instead of stopping at them.
+
+    With a connection, each mutation runs in its own savepoint, so a failing one leaves nothing behind (not even the
+    sequence number it took) while the others are kept.
+    """
+    results = []
+    for op, args in mutations:
+        if op not in WRITE_OPERATIONS:
+            results.append(ValueError(f"Unknown write operation '{op}'."))
+            continue
+        if conn is not None:
+            conn.execute("SAVEPOINT mutation")
+        try:
+            results.append(getattr(store, f"_{op}")(*args))
+        except errors as e:
+            if conn is not None:
+                conn.execute("ROLLBACK TO mutation")
+            results.append(e)
+        if conn is not None:
+            conn.execute("RELEASE mutation")
+    return results
+
+
+class _ClaimStore(ABC):
+    """Write methods shared by the stores. Each one is a batch of a single mutation."""
+
+    @abstractmethod
+    def apply_batch(self, mutations: List[Tuple[Text, Tuple]]) -> List[Any]:
+        """Applies `(operation, args)` mutations, returning each one's change record or the exception it raised."""
+
+    def _write(self, op: Text, *args: Any) -> Optional[Dict[Text, Any]]:
+        result = self.apply_batch([(op, args)])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def update_claim_balance(self, claim_id: Text, claim_balance: Any) -> Optional[Dict[Text, Any]]:
+        """Sets a claim's balance. Returns the change, or `None` if there is no such claim."""
+        return self._write("update_claim_balance", claim_id, claim_balance)
+
+    def add_claim(self, claim: Dict[Text, Any]) -> Dict[Text, Any]:
+        """Adds a claim. Raises `ClaimExists` if there already is a claim with its ID."""
+        return self._write("add_claim", claim)
+
+    def set_home_address(self, address: Dict[Text, Any]) -> Dict[Text, Any]:
+        return self._write("set_home_address", address)
+
+
+class InMemoryClaimStore(_ClaimStore):
+    """Keeps claims in the process, backed by the mock data dictionary."""
+
+    # Writes are plain dictionary updates and can run on the event loop.
+    blocking = False
+
+    def __init__(self, data: Dict[Text, Any]) -> None:
+        self._data = data
+        self._index = {str(c["claim_id"]): c for c in data["claims"]}
+        self._changed_seq: Dict[Text, int] = {}
+        self.last_seq = 0
+
+    def get_claim(self, claim_id: Any) -> Optional[Dict[Text, Any]]:
+        """Looks up a claim by its ID."""
+        return self._index.get(str(claim_id))
+
+    def claim_at(self, position: int) -> Optional[Dict[Text, Any]]:
+        """Gets the claim at a position in the member's claim listing."""
+        claims = self._data["claims"]
+        if 0 <= position < len(claims):
+            return claims[position]
+        return None
+
+    def count_claims(self) -> int:
+        return len(self._data["claims"])
+
+    def get_home_address(self) -> Dict[Text, Any]:
+        return self._data["member_info"]["home_address"]
+
+    def iter_claims(
+        self,
+        statuses: Optional[Iterable[Text]] = None,
+        date_from: Optional[int] = None,
+        date_to: Optional[int] = None,
+        changed_since: Optional[int] = None,
+        chunk_size: int = 1000,
+    ) -> Iterator[Dict[Text, Any]]:
+        """Yields the claims matching the filters in listing order, each with the sequence number it last changed at."""
+        statuses = set(statuses) if statuses is not None else None
+        for position in range(self.count_claims()):
+            clm = self.claim_at(position)
+            changed_seq = self._changed_seq.get(clm["claim_id"], 0)
+            if _matches(clm, statuses, date_from, date_to) and (changed_since is None or changed_seq > changed_since):
+                yield dict(clm, changed_seq=changed_seq)
+
+    def _next_seq(self) -> int:
+        self.last_seq += 1
+        return self.last_seq
+
+    def _update_claim_balance(self, claim_id: Text, claim_balance: Any) -> Optional[Dict[Text, Any]]:
+        clm = self.get_claim(claim_id)
+        if not clm:
+            return None
+        clm["claim_balance"] = claim_balance
+        seq = self._changed_seq[clm["claim_id"]] = self._next_seq()
+        return _change(seq, CLAIM_UPDATED, dict(clm), clm["claim_id"])
+
+    def _add_claim(self, claim: Dict[Text, Any]) -> Dict[Text, Any]:
+        if str(claim["claim_id"]) in self._index:
+            raise ClaimExists(claim["claim_id"])
+        # Dates are YYYYMMDD integers, as in the mock data.
+        claim = dict(claim, claim_date=int(claim["claim_date"]))
+        self._data["claims"].append(claim)
+        self._index[str(claim["claim_id"])] = claim
+        seq = self._changed_seq[claim["claim_id"]] = self._next_seq()
+        return _change(seq, CLAIM_CREATED, dict(claim), claim["claim_id"])
+
+    def _set_home_address(self, address: Dict[Text, Any]) -> Dict[Text, Any]:
+        home_address = {f: address.get(f) for f in ADDRESS_FIELDS}
+        self._data["member_info"]["home_address"] = home_address
+        return _change(self._next_seq(), ADDRESS_UPDATED, dict(home_address))
+
+    def apply_batch(self, mutations: List[Tuple[Text, Tuple]]) -> List[Any]:
+        """Applies `(operation, args)` mutations, returning each one's change record or the exception it raised."""
+        return _apply(self, mutations, (KeyError, ValueError, TypeError))
+
+
+class SQLiteClaimStore(_ClaimStore):
+    """Keeps claims in a SQLite database so several action server processes see the same state.
+
+    Connections are opened lazily and per process. The forking thread's connection is closed right before a fork, so
+    forked workers never inherit an open connection (SQLite's locks and WAL index don't survive a fork) and open their
+    own on first use.
+    """
+
+    # Writes wait on the database and should be kept off the event loop.
+    blocking = True
+
+    def __init__(self, path: Text) -> None:
+        self.path = path
+        self._local = threading.local()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(before=self.close)
+
+    def close(self) -> None:
+        """Closes this thread's connection. The next query opens a new one."""
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def initialize(self, data: Optional[Dict[Text, Any]] = None) -> None:
+        """Creates the tables and seeds them from the mock data, if given, when the database is empty."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS claims ("
+                         "position INTEGER PRIMARY KEY AUTOINCREMENT, "
+                         "claim_id TEXT NOT NULL UNIQUE, "
+                         "claim_date INTEGER NOT NULL, "
+                         "claim_balance REAL NOT NULL, "
+                         "claim_status TEXT NOT NULL, "
+                         "changed_seq INTEGER NOT NULL DEFAULT 0, "
+                         "listing INTEGER)")
+            conn.execute("CREATE TABLE IF NOT EXISTS member_info (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS sequences (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+            # Stores created before claims had a change sequence.
+            columns = [row["name"] for row in conn.execute("PRAGMA table_info(claims)")]
+            if "changed_seq" not in columns:
+                conn.execute("ALTER TABLE claims ADD COLUMN changed_seq INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS claims_changed_seq ON claims (changed_seq)")
+            # Stores created before claims had a listing index, which numbers the claims 0, 1, 2, ... in position
+            # order. Positions can have gaps, so the listing index is what `claim_at` looks up.
+            if "listing" not in columns:
+                conn.execute("ALTER TABLE claims ADD COLUMN listing INTEGER")
+                conn.execute("CREATE TEMP TABLE claim_listing (position INTEGER PRIMARY KEY, listing INTEGER NOT NULL)")
+                conn.execute("INSERT INTO claim_listing "
+                             "SELECT position, ROW_NUMBER() OVER (ORDER BY position) - 1 FROM claims")
+                conn.execute("UPDATE claims SET listing = "
+                             "(SELECT listing FROM claim_listing WHERE claim_listing.position = claims.position)")
+                conn.execute("DROP TABLE claim_listing")
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS claims_listing ON claims (listing)")
+            conn.execute("INSERT OR IGNORE INTO sequences (name, value) VALUES ('changes', 0)")
+
+            if data is not None:
+                if conn.execute("SELECT COUNT(*) FROM claims").fetchone()[0] == 0:
+                    conn.executemany("INSERT INTO claims (claim_id, claim_date, claim_balance, claim_status, listing) "
+                                     "VALUES (?, ?, ?, ?, ?)",
+                                     [tuple(c[f] for f in CLAIM_FIELDS) + (i,) for i, c in enumerate(data["claims"])])
+                conn.execute("INSERT OR IGNORE INTO member_info (key, value) VALUES ('home_address', ?)",
+                             (json.dumps(data["member_info"]["home_address"]),))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _claim(row: Optional[sqlite3.Row]) -> Optional[Dict[Text, Any]]:
+        if row is None:
+            return None
+        clm = {f: row[f] for f in CLAIM_FIELDS}
+        # Balances are stored as REAL, but whole amounts should look the same as they do in the mock data.
+        if float(clm["claim_balance"]).is_integer():
+            clm["claim_balance"] = int(clm["claim_balance"])
+        return clm
+
+    @property
+    def last_seq(self) -> int:
+        return self._connection().execute("SELECT value FROM sequences WHERE name = 'changes'").fetchone()[0]
+
+    def get_claim(self, claim_id: Any) -> Optional[Dict[Text, Any]]:
+        row = self._connection().execute("SELECT * FROM claims WHERE claim_id = ?", (str(claim_id),)).fetchone()
+        return self._claim(row)
+
+    def claim_at(self, position: int) -> Optional[Dict[Text, Any]]:
+        if position < 0:
+            return None
+        row = self._connection().execute("SELECT * FROM claims WHERE listing = ?", (position,)).fetchone()
+        return self._claim(row)
+
+    def count_claims(self) -> int:
+        # Claims are never deleted, so the listing index has no gaps and this is a single index lookup.
+        return self._connection().execute("SELECT COALESCE(MAX(listing) + 1, 0) FROM claims").fetchone()[0]
+
+    def get_home_address(self) -> Dict[Text, Any]:
+        row = self._connection().execute("SELECT value FROM member_info WHERE key = 'home_address'").fetchone()
+        return json.loads(row["value"])
+
+    def iter_claims(
+        self,
+        statuses: Optional[Iterable[Text]] = None,
+        date_from: Optional[int] = None,
+        date_to: Optional[int] = None,
+        changed_since: Optional[int] = None,
+        chunk_size: int = 1000,
+    ) -> Iterator[Dict[Text, Any]]:
+        """Yields the claims matching the filters in listing order, each with the sequence number it last changed at.
+
+        Claims are read `chunk_size` at a time, each chunk in its own short query, so a long export neither holds
+        millions of rows in memory nor keeps a read transaction open while writers commit.
+        """
+        where = ["position > ?"]
+        params: List[Any] = []
+        if statuses is not None:
+            statuses = list(statuses)
+            where.append(f"claim_status IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if date_from is not None:
+            where.append("claim_date >= ?")
+            params.append(date_from)
+        if date_to is not None:
+            where.append("claim_date <= ?")
+            params.append(date_to)
+        if changed_since is not None:
+            where.append("changed_seq > ?")
+            params.append(changed_since)
+        query = f"SELECT * FROM claims WHERE {' AND '.join(where)} ORDER BY position LIMIT ?"
+
+        conn = self._connection()
+        position = 0
+        while True:
+            rows = conn.execute(query, [position] + params + [chunk_size]).fetchall()
+            for row in rows:
+                yield dict(self._claim(row), changed_seq=row["changed_seq"])
+            if len(rows) < chunk_size:
+                return
+            position = rows[-1]["position"]
+
+    # The underscored write methods run inside the transaction opened by `apply_batch`.
+
+    def _next_seq(self) -> int:
+        conn = self._connection()
+        conn.execute("UPDATE sequences SET value = value + 1 WHERE name = 'changes'")
+        return conn.execute("SELECT value FROM sequences WHERE name = 'changes'").fetchone()[0]
+
+    def _update_claim_balance(self, claim_id: Text, claim_balance: Any) -> Optional[Dict[Text, Any]]:
+        clm = self.get_claim(claim_id)
+        if clm is None:
+            return None
+        seq = self._next_seq()
+        self._connection().execute("UPDATE claims SET claim_balance = ?, changed_seq = ? WHERE claim_id = ?",
+                                   (claim_balance, seq, str(claim_id)))
+        clm["claim_balance"] = claim_balance
+        return _change(seq, CLAIM_UPDATED, clm, clm["claim_id"])
+
+    def _add_claim(self, claim: Dict[Text, Any]) -> Dict[Text, Any]:
+        if self.get_claim(claim["claim_id"]) is not None:
+            raise ClaimExists(claim["claim_id"])
+        claim = dict(claim, claim_date=int(claim["claim_date"]))
+        seq = self._next_seq()
+        self._connection().execute("INSERT INTO claims "
+                                   "(claim_id, claim_date, claim_balance, claim_status, changed_seq, listing) "
+                                   f"VALUES (?, ?, ?, ?, ?, {_NEXT_LISTING})",
+                                   tuple(claim[f] for f in CLAIM_FIELDS) + (seq,))
+        return _change(seq, CLAIM_CREATED, {f: claim[f] for f in CLAIM_FIELDS}, claim["claim_id"])
+
+    def _set_home_address(self, address: Dict[Text, Any]) -> Dict[Text, Any]:
+        home_address = {f: address.get(f) for f in ADDRESS_FIELDS}
+        seq = self._next_seq()
+        self._connection().execute("INSERT OR REPLACE INTO member_info (key, value) VALUES ('home_address', ?)",
+                                   (json.dumps(home_address),))
+        return _change(seq, ADDRESS_UPDATED, home_address)
+
+    def import_claims(self, rows: List[Tuple[Text, int, float, Text]]) -> int:
+        """Inserts or updates `(claim_id, claim_date, claim_balance, claim_status)` rows in a single transaction.
+
+        The whole batch shares one sequence number, which is returned. Claims that already exist keep their position.
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            seq = self._next_seq()
+            conn.executemany("INSERT INTO claims "
+                             "(claim_id, claim_date, claim_balance, claim_status, changed_seq, listing) "
+                             f"VALUES (?, ?, ?, ?, ?, {_NEXT_LISTING}) "
+                             "ON CONFLICT (claim_id) DO UPDATE SET claim_date = excluded.claim_date, "
+                             "claim_balance = excluded.claim_balance, claim_status = excluded.claim_status, "
+                             "changed_seq = excluded.changed_seq",
+                             [row + (seq,) for row in rows])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return seq
+
+    def apply_batch(self, mutations: List[Tuple[Text, Tuple]]) -> List[Any]:
+        """Applies `(operation, args)` mutations in a single transaction.
+
+        Returns each mutation's change record or the exception it raised. A failing mutation doesn't undo the others.
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            results = _apply(self, mutations, (sqlite3.IntegrityError, KeyError, ValueError, TypeError), conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return results
+
+
+def store_from_env(data: Dict[Text, Any]):
+    """Builds the claim store configured by `CLAIM_STORE_PATH`, defaulting to the in-memory mock data."""
+    path = os.environ.get("CLAIM_STORE_PATH")
+    if not path:
+        return InMemoryClaimStore(data)
+
+    store = SQLiteClaimStore(path)
+    store.initialize(data)
+    return store
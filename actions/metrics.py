@@ -0,0 +1,112 @@
+"""Minimal in-process metrics, exposed by the action server in the Prometheus text format."""
+import threading
+from typing import Dict, Text, List, Tuple
+
+
+class Counter:
+    """A value that only goes up."""
+
+    type = "counter"
+
+    def __init__(self, name: Text, description: Text) -> None:
+        self.name = name
+        self.description = description
+        self._values: Dict[Tuple[Tuple[Text, Text], ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: Text) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: Text) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self) -> List[Tuple[Text, Dict[Text, Text], float]]:
+        return [(self.name, dict(key), value) for key, value in list(self._values.items())]
+
+
+class Gauge(Counter):
+    """A value that can go up and down."""
+
+    type = "gauge"
+
+    def set(self, value: float, **labels: Text) -> None:
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def dec(self, amount: float = 1, **labels: Text) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    """Counts observations into cumulative buckets."""
+
+    type = "histogram"
+
+    def __init__(self, name: Text, description: Text, buckets: List[float]) -> None:
+        self.name = name
+        self.description = description
+        self.buckets = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+                    break
+            else:
+                self._counts[-1] += 1
+            self._sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    def samples(self) -> List[Tuple[Text, Dict[Text, Text], float]]:
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + [float("inf")], self._counts):
+            cumulative += count
+            samples.append((f"{self.name}_bucket", {"le": "+Inf" if bound == float("inf") else str(bound)},
+                            cumulative))
+        samples.append((f"{self.name}_sum", {}, self._sum))
+        samples.append((f"{self.name}_count", {}, cumulative))
+        return samples
+
+
+class Registry:
+    """Holds the metrics of the process."""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[Text, object] = {}
+
+    def register(self, metric):
+        """Adds a metric, returning the one already registered under the same name if there is one."""
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: Text, description: Text) -> Counter:
+        return self.register(Counter(name, description))
+
+    def gauge(self, name: Text, description: Text) -> Gauge:
+        return self.register(Gauge(name, description))
+
+    def histogram(self, name: Text, description: Text, buckets: List[float]) -> Histogram:
+        return self.register(Histogram(name, description, buckets))
+
+    def render(self) -> Text:
+        """Renders all metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
@@ -0,0 +1,170 @@
+"""In-process extraction of money amounts and numbers from user messages.
+
+The payment, new claim and quote forms only need a plain amount or a whole number out of the user's message, e.g.
+"$1,200.50", "two hundred dollars", "5k" or "3 people". This covers those without a round trip to the Duckling server.
+"""
+import re
+from collections import namedtuple
+from typing import Text, List, Optional
+
+
+Quantity = namedtuple("Quantity", ["value", "start", "end", "is_money", "is_cents"])
+
+UNITS = {
+    "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9,
+    "ten": 10, "eleven": 11, "twelve": 12, "thirteen": 13, "fourteen": 14, "fifteen": 15, "sixteen": 16,
+    "seventeen": 17, "eighteen": 18, "nineteen": 19,
+}
+TENS = {
+    "twenty": 20, "thirty": 30, "forty": 40, "fourty": 40, "fifty": 50, "sixty": 60, "seventy": 70, "eighty": 80,
+    "ninety": 90,
+}
+SCALES = {"thousand": 1000, "million": 1000000, "billion": 1000000000}
+DIGIT_SCALES = dict(SCALES, k=1000, hundred=100)
+
+SCALE_WORDS = set(SCALES) | {"hundred"}
+NUMBER_WORDS = set(UNITS) | set(TENS) | SCALE_WORDS
+
+_DIGITS = re.compile(
+    # A minus sign counts when it stands on its own, as in "-50" but not in a range like "10-20".
+    r"(?:(?<![\w.,-])(?P<sign>-)|(?<![\w.,]))"
+    r"(?P<digits>\d{1,3}(?:,\d{2,3})+(?!\d)|\d+)(?:\.(?P<fraction>\d+))?"
+    r"(?:\s*(?P<scale>k|hundred|thousand|million|billion)\b)?"
+    r"(?!\w)",
+    re.IGNORECASE,
+)
+_WORD = re.compile(r"[a-z]+")
+_CURRENCY_BEFORE = re.compile(r"(?P<sign>-\s*)?(?:\$|\busd|\bus\$)\s*$", re.IGNORECASE)
+_MONEY_AFTER = re.compile(r"\s*(?:dollars?|bucks|usd)\b", re.IGNORECASE)
+_CENTS_AFTER = re.compile(r"\s*cents?\b", re.IGNORECASE)
+# Fractions, and decimal commas as in "$1,5", which would otherwise be read as a different number.
+_FRACTION = re.compile(r"\b(?:half|halves|quarters?)\b|\d\s*/\s*\d|\d,(?:\d|\d{4,})(?!\d)", re.IGNORECASE)
+# What can separate dollars from cents, as in "20 dollars and 50 cents".
+_CENTS_GAP = re.compile(r"\s*(?:and\s+|,\s*)?$", re.IGNORECASE)
+
+
+def _digit_quantities(text: Text) -> List[Quantity]:
+    quantities = []
+    for m in _DIGITS.finditer(text):
+        value = float(m.group("digits").replace(",", ""))
+        if m.group("fraction"):
+            value += float("0." + m.group("fraction"))
+        if m.group("scale"):
+            value *= DIGIT_SCALES[m.group("scale").lower()]
+        if m.group("sign"):
+            value = -value
+        quantities.append(_quantity(text, value, m.start(), m.end()))
+    return quantities
+
+
+def _word_quantities(text: Text) -> List[Quantity]:
+    """Finds numbers written out in words, like "two hundred and fifty" or "a thousand"."""
+    lowered = text.lower()
+    words = [(m.group(), m.start(), m.end()) for m in _WORD.finditer(lowered)]
+    quantities = []
+
+    i = 0
+    while i < len(words):
+        word = words[i][0]
+        next_word = words[i + 1][0] if i + 1 < len(words) else None
+        if word not in NUMBER_WORDS and not (word in ("a", "an") and next_word in SCALE_WORDS):
+            i += 1
+            continue
+
+        start = words[i][1]
+        end = words[i][2]
+        total = 0
+        current = 0
+        # What the last number word was: "unit" (up to nineteen), "tens", "hundred", "scale" or None.
+        last = None
+        while i < len(words):
+            word, word_start, word_end = words[i]
+            # Number words have to be next to each other, apart from hyphens and spaces ("twenty-five").
+            if word_start > end and lowered[end:word_start].strip(" -"):
+                break
+
+            value = UNITS.get(word, TENS.get(word))
+            if value is not None:
+                if last == "unit" and current < 100 and value >= 10:
+                    # Said the way prices are, as in "seven fifty" or "one twenty five".
+                    current = current * 100 + value
+                elif last == "unit" or (last == "tens" and value >= 10):
+                    # "one two" or "twenty thirty" are separate numbers.
+                    break
+                else:
+                    current += value
+                last = "unit" if word in UNITS else "tens"
+            elif word == "hundred":
+                current = (current or 1) * 100
+                last = "hundred"
+            elif word in SCALES:
+                total += (current or 1) * SCALES[word]
+                current = 0
+                last = "scale"
+            elif word in ("a", "an") and word_start == start:
+                pass
+            elif word == "and" and words[i - 1][0] in SCALE_WORDS and i + 1 < len(words) \
+                    and words[i + 1][0] in NUMBER_WORDS:
+                pass
+            else:
+                break
+            end = word_end
+            i += 1
+
+        quantities.append(_quantity(text, float(total + current), start, end))
+
+    return quantities
+
+
+def _quantity(text: Text, value: float, start: int, end: int) -> Quantity:
+    currency = _CURRENCY_BEFORE.search(text, 0, start)
+    is_money = bool(currency)
+    if currency and currency.group("sign") and value > 0:
+        # "-$50"
+        value = -value
+    after = _MONEY_AFTER.match(text, end) or _CENTS_AFTER.match(text, end)
+    is_cents = False
+    if after:
+        is_cents = after.re is _CENTS_AFTER
+        is_money = is_money or not is_cents
+        end = after.end()
+    return Quantity(value, start, end, is_money, is_cents)
+
+
+def extract_quantities(text: Optional[Text]) -> List[Quantity]:
+    """Finds all numbers in the text, in the order they appear.
+
+    Finds nothing in messages with fractions ("two and a half thousand", "1/2", "$1,5"), rather than a wrong number.
+    """
+    if not text or _FRACTION.search(text):
+        return []
+    return sorted(_digit_quantities(text) + _word_quantities(text), key=lambda q: q.start)
+
+
+def parse_amount(text: Optional[Text]) -> Optional[float]:
+    """Gets the money amount from a message, or the first number if no amount is marked as money.
+
+    Amounts with a minus sign, like "-$50", come back negative. Returns `None` if the message has no number in it.
+    """
+    quantities = extract_quantities(text)
+    if not quantities:
+        return None
+
+    for i, q in enumerate(quantities):
+        if q.is_money:
+            amount = q.value
+            following = quantities[i + 1] if i + 1 < len(quantities) else None
+            if following and following.is_cents and _CENTS_GAP.match(text[q.end:following.start]):
+                amount += following.value / 100
+            return round(amount, 2)
+
+    first = quantities[0]
+    return round(first.value / 100 if first.is_cents else first.value, 2)
+
+
+def parse_integer(text: Optional[Text]) -> Optional[int]:
+    """Gets the first whole number from a message, like the 3 in "3 people" or "three of us"."""
+    for q in extract_quantities(text):
+        if not q.is_cents and float(q.value).is_integer():
+            return int(q.value)
+    return None
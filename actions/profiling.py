@@ -0,0 +1,290 @@
+"""On-demand profiling of individual action invocations.
+
+An invocation is profiled when its action or sender ID has been asked for, or when it is picked by random sampling.
+Profiled invocations write two files to the output directory:
+
+* `<name>.folded`: stack samples in the collapsed format read by flamegraph.pl and speedscope.
+* `<name>.prof` and `<name>.txt`: per-function timings from cProfile, as raw pstats data and as a readable summary.
+  Only one invocation per thread can be under cProfile at a time, so invocations that overlap it on the event loop
+  only get the stack samples.
+
+Targets can be set up front with environment variables, or while the server is running by writing a trigger file
+(`python -m actions.profiling --sender-id <id>`), which every worker checks at most once a second. When nothing is
+requested and the sample rate is 0, the only cost per invocation is a couple of set lookups. Profiles are written by a
+background thread, so a profiled invocation doesn't hold up the other requests on the event loop while its files are
+written.
+
+Profiling is hooked into `actions.server`; `rasa run actions` doesn't profile anything.
+"""
+import os
+import re
+import sys
+import json
+import time
+import queue
+import pstats
+import random
+import logging
+import cProfile
+import threading
+import contextlib
+from collections import Counter
+from typing import Text, Iterable, Iterator, Optional
+
+
+logger = logging.getLogger(__name__)
+
+TRIGGER_FILE = "triggers.json"
+
+# Profiles waiting to be written. Further profiles are dropped until the writer catches up.
+MAX_PENDING_WRITES = 64
+
+
+def _env_list(name: Text) -> Iterable[Text]:
+    return [v.strip() for v in os.environ.get(name, "").split(",") if v.strip()]
+
+
+class StackSampler:
+    """Samples the call stack of one thread at a fixed interval."""
+
+    def __init__(self, thread_id: int, interval: float = 0.001) -> None:
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="action-profiler-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops sampling. The samples are complete once `join` returns."""
+        self._stop.set()
+
+    def join(self) -> None:
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def write_folded(self, path: Text) -> None:
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class ActionProfiler:
+    """Decides which action invocations to profile and writes out their profiles."""
+
+    def __init__(
+        self,
+        output_dir: Text,
+        sample_rate: float = 0.0,
+        sender_ids: Iterable[Text] = (),
+        action_names: Iterable[Text] = (),
+        sampling_interval: float = 0.001,
+        trigger_check_interval: float = 1.0,
+    ) -> None:
+        self.output_dir = output_dir
+        self.sample_rate = sample_rate
+        self.sampling_interval = sampling_interval
+        self.trigger_check_interval = trigger_check_interval
+        self._static_sender_ids = frozenset(sender_ids)
+        self._static_action_names = frozenset(action_names)
+        self._sender_ids = self._static_sender_ids
+        self._action_names = self._static_action_names
+        self._next_trigger_check = 0.0
+        # Threads with a cProfile running. Only one can be active per thread.
+        self._cprofile_threads = set()
+        self._lock = threading.Lock()
+        self._writes: queue.Queue = queue.Queue(maxsize=MAX_PENDING_WRITES)
+        self._writer_pid: Optional[int] = None
+
+    @property
+    def trigger_path(self) -> Text:
+        return os.path.join(self.output_dir, TRIGGER_FILE)
+
+    def should_profile(self, action_name: Text, sender_id: Text) -> bool:
+        """Checks if this invocation should be profiled."""
+        now = time.monotonic()
+        if now >= self._next_trigger_check:
+            self._next_trigger_check = now + self.trigger_check_interval
+            self._load_triggers()
+
+        if action_name in self._action_names or sender_id in self._sender_ids:
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def request(self, sender_ids: Iterable[Text] = (), action_names: Iterable[Text] = (), duration: float = 60.0):
+        """Asks every worker using this output directory to profile the given senders and actions for `duration`
+        seconds."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        trigger = {"sender_ids": list(sender_ids), "action_names": list(action_names), "until": time.time() + duration}
+        tmp_path = f"{self.trigger_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(trigger, f)
+        os.replace(tmp_path, self.trigger_path)
+        self._next_trigger_check = 0.0
+
+    def _load_triggers(self) -> None:
+        sender_ids = self._static_sender_ids
+        action_names = self._static_action_names
+        try:
+            with open(self.trigger_path, "r") as f:
+                trigger = json.load(f)
+            if trigger.get("until", 0) > time.time():
+                sender_ids = sender_ids | frozenset(trigger.get("sender_ids", []))
+                action_names = action_names | frozenset(trigger.get("action_names", []))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning(f"Ignoring profiling trigger file '{self.trigger_path}': {e}")
+
+        self._sender_ids = sender_ids
+        self._action_names = action_names
+
+    @contextlib.contextmanager
+    def profile(self, action_name: Text, sender_id: Text) -> Iterator[None]:
+        """Profiles the code run inside the block.
+
+        cProfile and the stack sampler cover everything running on the thread, so other requests served by the event
+        loop while the action awaits show up in the profile too. cProfile hooks the whole thread and a second profiler
+        would take the hook over from the first, so an invocation that overlaps another profiled one on the same thread
+        only gets stack samples.
+        """
+        thread_id = threading.get_ident()
+        sampler = StackSampler(thread_id, self.sampling_interval)
+        profiler = None
+        with self._lock:
+            if thread_id not in self._cprofile_threads:
+                self._cprofile_threads.add(thread_id)
+                profiler = cProfile.Profile()
+        started = time.perf_counter()
+
+        sampler.start()
+        if profiler is not None:
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiling tool already holds the hook (Python 3.12+ refuses to replace it).
+                self._release_cprofile(thread_id)
+                profiler = None
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self._release_cprofile(thread_id)
+            sampler.stop()
+            elapsed = time.perf_counter() - started
+            self._queue_write(action_name, sender_id, sampler, profiler, elapsed)
+
+    def flush(self) -> None:
+        """Waits until the profiles queued so far have been written."""
+        self._writes.join()
+
+    def _queue_write(self, action_name: Text, *args) -> None:
+        with self._lock:
+            # Threads don't survive a fork, so each pre-forked worker starts its own writer, with its own queue.
+            if self._writer_pid != os.getpid():
+                self._writer_pid = os.getpid()
+                self._writes = queue.Queue(maxsize=MAX_PENDING_WRITES)
+                threading.Thread(target=self._write_forever, name="action-profiler-writer", daemon=True).start()
+        try:
+            self._writes.put_nowait((action_name,) + args)
+        except queue.Full:
+            logger.warning(f"Dropping the profile of '{action_name}', {MAX_PENDING_WRITES} profiles are waiting to be "
+                           f"written.")
+
+    def _write_forever(self) -> None:
+        writes = self._writes
+        while True:
+            action_name, sender_id, sampler, profiler, elapsed = writes.get()
+            try:
+                sampler.join()
+                self._write(action_name, sender_id, sampler, profiler, elapsed)
+            except OSError as e:
+                logger.warning(f"Could not write the profile of '{action_name}': {e}")
+            except Exception:
+                logger.exception(f"Failed to write the profile of '{action_name}'.")
+            finally:
+                writes.task_done()
+
+    def _release_cprofile(self, thread_id: int) -> None:
+        with self._lock:
+            self._cprofile_threads.discard(thread_id)
+
+    def _write(
+        self,
+        action_name: Text,
+        sender_id: Text,
+        sampler: StackSampler,
+        profiler: Optional[cProfile.Profile],
+        elapsed: float,
+    ) -> None:
+        os.makedirs(self.output_dir, exist_ok=True)
+        safe_sender_id = re.sub(r"[^\w.-]", "_", sender_id or "unknown")[:64]
+        now = time.time()
+        timestamp = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}.{int(now * 1000) % 1000:03d}"
+        name = f"{timestamp}-{os.getpid()}-{action_name}-{safe_sender_id}"
+        path = os.path.join(self.output_dir, name)
+
+        sampler.write_folded(f"{path}.folded")
+        if profiler is not None:
+            profiler.dump_stats(f"{path}.prof")
+        with open(f"{path}.txt", "w") as f:
+            f.write(f"{action_name} for {sender_id} took {elapsed * 1000:.2f} ms\n\n")
+            if profiler is not None:
+                pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(40)
+            else:
+                f.write("No cProfile timings, another invocation was being profiled on the same thread. "
+                        "See the .folded stack samples.\n")
+
+        logger.info(f"Wrote profile of '{action_name}' ({elapsed * 1000:.2f} ms) to {path}.*")
+
+
+def profiler_from_env() -> Optional[ActionProfiler]:
+    """Builds the profiler configured by the `ACTION_PROFILE_*` environment variables.
+
+    Profiling is off unless `ACTION_PROFILE_DIR` is set.
+    """
+    output_dir = os.environ.get("ACTION_PROFILE_DIR")
+    if not output_dir:
+        return None
+
+    return ActionProfiler(
+        output_dir,
+        sample_rate=float(os.environ.get("ACTION_PROFILE_SAMPLE_RATE", 0.0)),
+        sender_ids=_env_list("ACTION_PROFILE_SENDER_IDS"),
+        action_names=_env_list("ACTION_PROFILE_ACTIONS"),
+        sampling_interval=float(os.environ.get("ACTION_PROFILE_INTERVAL", 0.001)),
+    )
+
+
+def main(args=None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Asks running action server workers to profile some invocations.")
+    parser.add_argument("--dir", default=os.environ.get("ACTION_PROFILE_DIR"),
+                        required="ACTION_PROFILE_DIR" not in os.environ,
+                        help="Profile directory the action server was started with (ACTION_PROFILE_DIR).")
+    parser.add_argument("--sender-id", action="append", default=[], help="Sender ID to profile. Can be repeated.")
+    parser.add_argument("--action", action="append", default=[], help="Action name to profile. Can be repeated.")
+    parser.add_argument("--duration", type=float, default=60.0, help="How many seconds to keep profiling for.")
+    parsed = parser.parse_args(args)
+
+    ActionProfiler(parsed.dir).request(parsed.sender_id, parsed.action, parsed.duration)
+    print(f"Profiling {parsed.sender_id + parsed.action} for {parsed.duration:.0f}s, "
+          f"profiles are written to {parsed.dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Quote rates that can be reloaded while the action server is running.
+
+The rates are read into an immutable `ReferenceData` snapshot. A background thread watches the source file and, when it
+changes, builds a complete new snapshot before swapping it in with a single assignment. Actions grab the current
+snapshot once per call, so they never see a half-built table and lookups cost the same before and after a reload.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from types import MappingProxyType
+from typing import Dict, Text, Any, Optional, Mapping, FrozenSet
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLL_INTERVAL = 5.0
+
+
+class ReferenceData:
+    """An immutable snapshot of the reference data."""
+
+    def __init__(self, quote_rates: Dict[Text, Any]) -> None:
+        self.quote_rates: Mapping[Text, Any] = MappingProxyType({k.lower(): v for k, v in quote_rates.items()})
+        self.insurance_types: FrozenSet[Text] = frozenset(self.quote_rates)
+
+    @classmethod
+    def from_dict(cls, data: Dict[Text, Any]) -> "ReferenceData":
+        return cls(data["policy_quote"]["insurance_type"])
+
+    @classmethod
+    def from_file(cls, path: Text) -> "ReferenceData":
+        with open(path, "r") as f:
+            return cls.from_dict(json.load(f))
+
+
+def _signature(path: Text):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+class ReloadingReferenceData:
+    """Holds the current reference data snapshot and replaces it when the source file changes."""
+
+    def __init__(self, path: Text, poll_interval: float = DEFAULT_POLL_INTERVAL) -> None:
+        self.path = path
+        self.poll_interval = poll_interval
+        self._signature = _signature(path)
+        self._snapshot = ReferenceData.from_file(path)
+        self._watcher_pid: Optional[int] = None
+
+    def current(self) -> ReferenceData:
+        """Returns the latest snapshot, starting the file watcher in this process if it isn't running yet."""
+        # Threads don't survive a fork, so each pre-forked worker starts its own watcher.
+        if self._watcher_pid != os.getpid() and self.poll_interval > 0:
+            self._start_watcher()
+        return self._snapshot
+
+    def reload(self) -> bool:
+        """Rebuilds the snapshot if the source file changed. Returns whether a new snapshot was swapped in."""
+        try:
+            signature = _signature(self.path)
+        except OSError as e:
+            logger.warning(f"Could not check reference data file '{self.path}': {e}")
+            return False
+
+        if signature == self._signature:
+            return False
+        self._signature = signature
+
+        try:
+            snapshot = ReferenceData.from_file(self.path)
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            # Most likely the file is still being written; keep serving the previous snapshot.
+            logger.warning(f"Keeping the current reference data, failed to load '{self.path}': {e}")
+            return False
+
+        self._snapshot = snapshot
+        logger.info(f"Reloaded reference data from '{self.path}'.")
+        return True
+
+    def _start_watcher(self) -> None:
+        self._watcher_pid = os.getpid()
+        thread = threading.Thread(target=self._watch, name="reference-data-watcher", daemon=True)
+        thread.start()
+
+    def _watch(self) -> None:
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.reload()
+            except Exception:
+                logger.exception("Failed to reload reference data.")
+
+
+def reference_data_from_env(default_path: Text) -> ReloadingReferenceData:
+    """Builds the reference data holder configured by `REFERENCE_DATA_PATH` and `REFERENCE_DATA_POLL_INTERVAL`.
+
+    Setting the poll interval to 0 turns reloading off.
+    """
+    path = os.environ.get("REFERENCE_DATA_PATH", default_path)
+    poll_interval = float(os.environ.get("REFERENCE_DATA_POLL_INTERVAL", DEFAULT_POLL_INTERVAL))
+    return ReloadingReferenceData(path, poll_interval)
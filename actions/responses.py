@@ -0,0 +1,177 @@
+"""Renders domain responses in the action server instead of leaving it to Rasa.
+
+`dispatcher.utter_message(template=...)` only sends the response name and its parameters. Rasa then looks the
+response up in the domain and fills it in on every turn. With `RENDER_RESPONSES=true`, the `responses:` section of
+`domain.yml` is loaded once at startup and every text, button and other field is compiled into a formatter, so the
+actions send ready-made messages.
+
+Rendering gives the same result as Rasa's template interpolation: slot values and the action's parameters fill
+`{placeholders}`, and the response name and parameters are sent along as message metadata like Rasa does. Responses
+with channel or condition specific variations are left to Rasa.
+"""
+import os
+import re
+import copy
+import random
+import logging
+from string import Formatter
+from typing import Dict, Text, Any, List, Optional, Callable
+
+from ruamel.yaml import YAML
+
+
+logger = logging.getLogger(__name__)
+
+# Response fields Rasa fills in.
+INTERPOLATED_KEYS = ["text", "image", "custom", "buttons", "attachment", "quick_replies"]
+
+# Response fields that have their own `utter_message` argument.
+MESSAGE_ARGUMENTS = {"text": "text", "image": "image", "custom": "json_message", "buttons": "buttons",
+                     "attachment": "attachment", "elements": "elements"}
+
+_PLACEHOLDER = re.compile(r"{([^\n{}]+?)}")
+_FIELD = re.compile(r"0\[([^\[\]]+)\]")
+# Characters that mean something else in a `format_map` field name.
+_UNSAFE_NAME = re.compile(r"[.\[\]{}:!]")
+
+
+def interpolate_text(text: Text, values: Dict[Text, Any]) -> Text:
+    """Fills the `{placeholders}` in a response text the way Rasa's interpolator does."""
+    try:
+        rendered = _PLACEHOLDER.sub(r"{0[\1]}", text).format(values)
+        if "0[" in rendered:
+            # A placeholder in doubled braces, as in button payloads, which `format` only unescaped.
+            return text.format({})
+        return rendered
+    except (KeyError, IndexError, ValueError):
+        return text
+
+
+def interpolate(response: Any, values: Dict[Text, Any]) -> Any:
+    """Fills the `{placeholders}` in a response field and everything nested in it."""
+    if isinstance(response, str):
+        return interpolate_text(response, values)
+    if isinstance(response, dict):
+        return {k: interpolate(v, values) for k, v in response.items()}
+    if isinstance(response, list):
+        return [interpolate(v, values) for v in response]
+    return response
+
+
+def _compile_text(text: Text) -> Callable[[Dict[Text, Any]], Text]:
+    """Turns the placeholders into plain `{name}` fields once, so filling in the text is a single `format_map`.
+
+    Texts whose placeholders `format_map` would read differently are filled in with `interpolate_text` instead.
+    """
+    fmt = []
+    has_fields = False
+    try:
+        for literal, field, spec, conversion in Formatter().parse(_PLACEHOLDER.sub(r"{0[\1]}", text)):
+            if "0[" in literal:
+                raise ValueError("Placeholder in doubled braces.")
+            fmt.append(literal.replace("{", "{{").replace("}", "}}"))
+            if field is None:
+                continue
+            match = _FIELD.fullmatch(field)
+            if not match or spec or conversion or match.group(1).isdigit() or _UNSAFE_NAME.search(match.group(1)):
+                raise ValueError(f"Unsupported placeholder '{field}'.")
+            fmt.append(f"{{{match.group(1)}}}")
+            has_fields = True
+    except ValueError:
+        return lambda values: interpolate_text(text, values)
+
+    fmt = "".join(fmt)
+    if not has_fields:
+        rendered = fmt.format_map({})
+        return lambda values: rendered
+
+    def render(values: Dict[Text, Any]) -> Text:
+        try:
+            rendered = fmt.format_map(values)
+        except KeyError:
+            return text
+        if "0[" in rendered:
+            return interpolate_text(text, values)
+        return rendered
+
+    return render
+
+
+def _compile(response: Any) -> Callable[[Dict[Text, Any]], Any]:
+    if isinstance(response, str):
+        return _compile_text(response)
+    if isinstance(response, dict):
+        fields = [(k, _compile(v)) for k, v in response.items()]
+        return lambda values: {k: render(values) for k, render in fields}
+    if isinstance(response, list):
+        items = [_compile(v) for v in response]
+        return lambda values: [render(values) for render in items]
+    return lambda values: response
+
+
+def _constant(value: Any) -> Callable[[Dict[Text, Any]], Any]:
+    return lambda values: copy.deepcopy(value)
+
+
+class CompiledResponse:
+    """One variation of a response, ready to be filled in."""
+
+    def __init__(self, variation: Dict[Text, Any]) -> None:
+        self.variation = variation
+        self._fields = [(k, _compile(v) if k in INTERPOLATED_KEYS else _constant(v)) for k, v in variation.items()]
+
+    def render(self, values: Dict[Text, Any]) -> Dict[Text, Any]:
+        if not values:
+            # Rasa leaves responses alone when there is nothing to fill them with.
+            return copy.deepcopy(self.variation)
+        return {k: render(values) for k, render in self._fields}
+
+
+class ResponseRenderer:
+    """Compiled domain responses, by name."""
+
+    def __init__(self, responses: Dict[Text, List[Dict[Text, Any]]]) -> None:
+        self.responses: Dict[Text, List[CompiledResponse]] = {}
+        for name, variations in responses.items():
+            if not variations or any("channel" in v or "condition" in v for v in variations):
+                continue
+            self.responses[name] = [CompiledResponse(v) for v in variations]
+
+    @classmethod
+    def from_domain(cls, path: Text) -> "ResponseRenderer":
+        with open(path, "r") as f:
+            domain = YAML(typ="safe").load(f)
+        return cls(domain.get("responses") or domain.get("templates") or {})
+
+    def render(
+        self, name: Text, slots: Dict[Text, Any], kwargs: Dict[Text, Any]
+    ) -> Optional[Dict[Text, Any]]:
+        """Fills in a response with the slots and the `utter_message` parameters.
+
+        Returns the arguments for `utter_message`, or `None` if the response has to be left to Rasa.
+        """
+        variations = self.responses.get(name)
+        if variations is None:
+            return None
+
+        values = dict(slots)
+        values.update(kwargs)
+        variation = variations[0] if len(variations) == 1 else random.choice(variations)
+
+        message = {}
+        for key, value in variation.render(values).items():
+            message[MESSAGE_ARGUMENTS.get(key, key)] = value
+        message["template_name"] = name
+        message.update(kwargs)
+        return message
+
+
+def renderer_from_env(default_path: Text) -> Optional[ResponseRenderer]:
+    """Builds the renderer when `RENDER_RESPONSES` is set, from the domain at `DOMAIN_PATH` or `default_path`."""
+    if os.environ.get("RENDER_RESPONSES", "").lower() not in ("1", "true", "yes"):
+        return None
+
+    path = os.environ.get("DOMAIN_PATH", default_path)
+    renderer = ResponseRenderer.from_domain(path)
+    logger.info(f"Rendering {len(renderer.responses)} responses from '{path}' in the action server.")
+    return renderer
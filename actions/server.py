@@ -0,0 +1,329 @@
+"""Pre-fork multi-worker action server.
+
+The parent process imports the actions once (loading the mock data and every lookup structure built from it) and then
+forks the workers. The workers share that memory copy-on-write and each one accepts connections on the same port through
+`SO_REUSEPORT`, so the kernel spreads connections across them. Mutable claim state lives in the SQLite claim store so
+all workers see the same claims.
+
+Action calls are decoded with `actions.tracker_decoding`, which leaves the tracker's event history encoded until an
+action reads it. Each worker limits how many action calls run at once with `actions.admission`.
+
+Run it from the project root with:
+
+    python -m actions.server --workers 4 --claim-store claims.db
+"""
+import os
+import gc
+import sys
+import time
+import errno
+import signal
+import socket
+import logging
+import argparse
+from typing import Dict, Text, Any, List, Optional
+
+from sanic import Sanic, response
+from sanic.request import Request
+from sanic.response import HTTPResponse
+
+from rasa_sdk import utils, Tracker
+from rasa_sdk.events import EventType
+from rasa_sdk.constants import DEFAULT_SERVER_PORT
+from rasa_sdk.endpoint import configure_cors
+from rasa_sdk.executor import ActionExecutor, CollectingDispatcher
+from rasa_sdk.interfaces import ActionExecutionRejection, ActionNotFoundException
+
+from actions.admission import AdmissionRejected, admission_from_env
+from actions.metrics import REGISTRY
+from actions.profiling import ActionProfiler, profiler_from_env
+from actions.tracker_decoding import ActionCall, decode_action_call
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CLAIM_STORE_PATH = "claims.db"
+
+# A worker that dies sooner than this after starting is considered to be crash looping.
+MIN_WORKER_UPTIME = 1.0
+
+
+class LazyTracker(Tracker):
+    """Tracker whose events are only decoded when an action reads them."""
+
+    def __init__(self, action_call: ActionCall) -> None:
+        self._action_call = action_call
+        # Slot events added by `add_slots` before the event history was decoded.
+        self._added_events: List[Dict[Text, Any]] = []
+        state = action_call.tracker
+        super().__init__(
+            state["sender_id"],
+            state.get("slots", {}),
+            state.get("latest_message", {}),
+            None,
+            state.get("paused", False),
+            state.get("followup_action"),
+            state.get("active_loop", state.get("active_form", {})),
+            state.get("latest_action_name"),
+        )
+
+    @property
+    def events(self) -> List[Dict[Text, Any]]:
+        if self._events is None:
+            self._events = self._action_call.events() + self._added_events
+        return self._events
+
+    @events.setter
+    def events(self, events: Optional[List[Dict[Text, Any]]]) -> None:
+        self._events = events
+
+    def slots_to_validate(self) -> Dict[Text, Any]:
+        """Same as `Tracker.slots_to_validate`, but only reads the slot events at the end of the history."""
+        if self._events is not None:
+            return super().slots_to_validate()
+        return {e["name"]: e["value"] for e in self._action_call.trailing_slot_events() + self._added_events}
+
+    def add_slots(self, slots: List[EventType]) -> None:
+        """Same as `Tracker.add_slots`, but doesn't decode the event history to append to it."""
+        if self._events is not None:
+            return super().add_slots(slots)
+        for event in slots:
+            if event.get("event") != "slot":
+                continue
+            self.slots[event["name"]] = event["value"]
+            self._added_events.append(event)
+
+
+async def run_action(
+    executor: ActionExecutor, action_call: ActionCall, profiler: Optional[ActionProfiler] = None
+) -> Optional[Dict[Text, Any]]:
+    """Runs the requested action the same way `ActionExecutor.run` does, but with a `LazyTracker`."""
+    action_name = action_call.next_action
+    if not action_name:
+        logger.warning("Received an action call without an action.")
+        return None
+
+    logger.debug(f"Received request to run '{action_name}'")
+    action = executor.actions.get(action_name)
+    if not action:
+        raise ActionNotFoundException(action_name)
+
+    tracker = LazyTracker(action_call)
+    dispatcher = CollectingDispatcher()
+
+    if profiler and profiler.should_profile(action_name, tracker.sender_id):
+        with profiler.profile(action_name, tracker.sender_id):
+            events = action(dispatcher, tracker, action_call.domain)
+            if utils.is_coroutine_action(action):
+                events = await events
+    else:
+        events = action(dispatcher, tracker, action_call.domain)
+        if utils.is_coroutine_action(action):
+            events = await events
+
+    if not events:
+        # make sure the action did not just return `None`...
+        events = []
+
+    validated_events = executor.validate_events(events, action_name)
+    logger.debug(f"Finished running '{action_name}'")
+    return executor._create_api_response(validated_events, dispatcher.messages)
+
+
+def create_app(action_package_name: Text, cors_origins: Text = "*", auto_reload: bool = False) -> Sanic:
+    """Creates the action server app. Mirrors `rasa_sdk.endpoint.create_app` apart from how requests are decoded."""
+    app = Sanic(__name__, configure_logging=False)
+
+    configure_cors(app, cors_origins)
+
+    executor = ActionExecutor()
+    executor.register_package(action_package_name)
+
+    profiler = profiler_from_env()
+    admission = admission_from_env()
+
+    @app.get("/health")
+    async def health(_) -> HTTPResponse:
+        """Ping endpoint to check if the server is running and well."""
+        body = {"status": "ok"}
+        return response.json(body, status=200)
+
+    @app.post("/webhook")
+    async def webhook(request: Request) -> HTTPResponse:
+        """Webhook to retrieve action calls."""
+        try:
+            action_call = decode_action_call(request.body)
+        except ValueError:
+            body = {"error": "Invalid body request"}
+            return response.json(body, status=400)
+
+        utils.check_version_compatibility(action_call.version)
+
+        if auto_reload:
+            executor.reload()
+
+        try:
+            if admission is not None:
+                async with admission.admit(action_call.next_action, action_call.sender_id):
+                    result = await run_action(executor, action_call, profiler)
+            else:
+                result = await run_action(executor, action_call, profiler)
+        except AdmissionRejected as e:
+            body = {"error": e.message, "action_name": action_call.next_action}
+            return response.json(body, status=e.status, headers={"Retry-After": str(e.retry_after)})
+        except ActionExecutionRejection as e:
+            logger.debug(e)
+            body = {"error": e.message, "action_name": e.action_name}
+            return response.json(body, status=400)
+        except ActionNotFoundException as e:
+            logger.error(e)
+            body = {"error": e.message, "action_name": e.action_name}
+            return response.json(body, status=404)
+
+        return response.json(result, status=200)
+
+    @app.get("/actions")
+    async def actions(_) -> HTTPResponse:
+        """List all registered actions."""
+        if auto_reload:
+            executor.reload()
+
+        body = [{"name": k} for k in executor.actions.keys()]
+        return response.json(body, status=200)
+
+    @app.get("/metrics")
+    async def metrics(_) -> HTTPResponse:
+        """Metrics of this worker in the Prometheus text format."""
+        return response.text(REGISTRY.render(), content_type="text/plain; version=0.0.4")
+
+    return app
+
+
+def bind_socket(host: Text, port: int, backlog: int = 1024) -> socket.socket:
+    """Opens a listening socket that other workers can bind to as well."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+class PreforkServer:
+    """Forks and supervises action server workers that share the parent's memory."""
+
+    def __init__(self, app, host: Text, port: int, workers: int) -> None:
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.children: Dict[int, float] = {}
+        self.stopping = False
+
+    def _serve(self) -> None:
+        """Runs a single worker. Only called in the forked child."""
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+        sock = bind_socket(self.host, self.port)
+        logger.info(f"Worker {os.getpid()} accepting connections on {self.host}:{self.port}")
+        self.app.run(sock=sock, workers=1, access_log=False)
+
+    def _spawn(self) -> None:
+        # SQLite claim stores close the parent's connection right before the fork, so workers start without one.
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                self._serve()
+            except Exception:
+                logger.exception(f"Worker {os.getpid()} failed.")
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+
+        self.children[pid] = time.monotonic()
+
+    def _stop(self, signum, frame) -> None:
+        self.stopping = True
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self) -> None:
+        """Starts the workers and restarts any that exit until the server is stopped."""
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        # Move everything loaded so far out of the garbage collector's reach, so collections in the workers don't
+        # touch (and copy) the shared pages.
+        gc.freeze()
+
+        for _ in range(self.workers):
+            self._spawn()
+
+        logger.info(f"Action endpoint is up and running on {self.host}:{self.port} with {self.workers} workers")
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except InterruptedError:
+                continue
+            except OSError as e:
+                if e.errno == errno.ECHILD:
+                    break
+                raise
+
+            started = self.children.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+
+            logger.warning(f"Worker {pid} exited with status {status}, starting a new one.")
+            if time.monotonic() - started < MIN_WORKER_UPTIME:
+                time.sleep(MIN_WORKER_UPTIME)
+            self._spawn()
+
+
+def run(
+    action_package_name: Text = "actions",
+    host: Text = "0.0.0.0",
+    port: int = DEFAULT_SERVER_PORT,
+    workers: Optional[int] = None,
+    claim_store_path: Optional[Text] = None,
+) -> None:
+    """Loads the actions once and serves them from `workers` forked processes."""
+    workers = workers or os.cpu_count() or 1
+
+    # Workers can't share the in-memory mock data, so use a claim store they can all see.
+    claim_store_path = claim_store_path or os.environ.get("CLAIM_STORE_PATH")
+    if workers > 1 and not claim_store_path:
+        claim_store_path = DEFAULT_CLAIM_STORE_PATH
+    if claim_store_path:
+        os.environ["CLAIM_STORE_PATH"] = claim_store_path
+
+    # Importing the action package here loads all of the reference data in the parent.
+    app = create_app(action_package_name)
+
+    PreforkServer(app, host, port, workers).run()
+
+
+def main(args=None) -> None:
+    parser = argparse.ArgumentParser(description="Runs the action server with several pre-forked workers.")
+    parser.add_argument("--actions", default="actions", help="Name of the action package to load.")
+    parser.add_argument("--host", default=os.environ.get("SANIC_HOST", "0.0.0.0"), help="Interface to bind to.")
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_SERVER_PORT, help="Port to run the server at.")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="Number of worker processes. Defaults to the number of CPUs.")
+    parser.add_argument("--claim-store", default=None,
+                        help=f"SQLite file holding the claims. Defaults to $CLAIM_STORE_PATH, or "
+                             f"'{DEFAULT_CLAIM_STORE_PATH}' when running more than one worker.")
+    parsed = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(process)d] %(levelname)s %(name)s - %(message)s")
+    run(parsed.actions, parsed.host, parsed.port, parsed.workers, parsed.claim_store)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""Partial decoding of the `/webhook` request body.
+
+Rasa sends the whole tracker with every action call, including the full event history. Our actions only read a few
+slots, the latest message and the sender ID, so only those fields are decoded up front. The event history stays encoded
+in the request body and is decoded the first time something asks for it. The slot events at the end of the history,
+which form validation reads to find the slots it has to validate, are picked out on their own.
+
+With `pysimdjson` installed the body is parsed lazily and only the fields we touch are turned into Python objects.
+Without it everything falls back to the standard library `json` module, which decodes the whole body.
+"""
+import json
+import threading
+from typing import Dict, Text, Any, List, Optional
+
+try:
+    import simdjson
+except ImportError:  # pragma: no cover
+    simdjson = None
+
+
+TRACKER_FIELDS = ["sender_id", "slots", "latest_message", "paused", "followup_action", "active_loop", "active_form",
+                  "latest_action_name"]
+
+_local = threading.local()
+
+
+def _parser():
+    parser = getattr(_local, "parser", None)
+    if parser is None:
+        parser = _local.parser = simdjson.Parser()
+    return parser
+
+
+def _materialize(value: Any) -> Any:
+    """Turns a lazy simdjson value into plain Python objects."""
+    if isinstance(value, simdjson.Object):
+        return value.as_dict()
+    if isinstance(value, simdjson.Array):
+        return value.as_list()
+    return value
+
+
+class ActionCall:
+    """An action call with everything but the tracker events decoded."""
+
+    def __init__(
+        self,
+        body: bytes,
+        next_action: Optional[Text],
+        version: Optional[Text],
+        tracker: Dict[Text, Any],
+        domain: Dict[Text, Any],
+        events: Optional[List[Dict[Text, Any]]] = None,
+        trailing_slot_events: Optional[List[Dict[Text, Any]]] = None,
+    ) -> None:
+        self._body = body
+        self.next_action = next_action
+        self.version = version
+        self.tracker = tracker
+        self.domain = domain
+        self._events = events
+        self._trailing_slot_events = trailing_slot_events
+
+    @property
+    def sender_id(self) -> Text:
+        return self.tracker["sender_id"]
+
+    def events(self) -> List[Dict[Text, Any]]:
+        """Decodes the tracker events. The result is cached, so only the first call pays for it."""
+        if self._events is None:
+            loads = simdjson.loads if simdjson else json.loads
+            self._events = loads(self._body)["tracker"].get("events", [])
+            # The body is only kept around for the events.
+            self._body = None
+        return self._events
+
+    def trailing_slot_events(self) -> List[Dict[Text, Any]]:
+        """The slot events at the end of the event history, in order."""
+        if self._trailing_slot_events is None:
+            events = self.events()
+            start = len(events)
+            while start > 0 and events[start - 1].get("event") == "slot":
+                start -= 1
+            self._trailing_slot_events = events[start:]
+        return self._trailing_slot_events
+
+
+def _trailing_slot_events(events_doc: Any) -> List[Dict[Text, Any]]:
+    """Reads the slot events at the end of a lazy simdjson event array, without touching the ones before them."""
+    if not isinstance(events_doc, simdjson.Array):
+        return []
+    trailing = []
+    for i in range(len(events_doc) - 1, -1, -1):
+        event = events_doc[i]
+        if not isinstance(event, simdjson.Object) or event.get("event") != "slot":
+            break
+        trailing.append(event.as_dict())
+    trailing.reverse()
+    return trailing
+
+
+def decode_action_call(body: bytes) -> ActionCall:
+    """Decodes a `/webhook` request body, leaving the tracker events for later.
+
+    Raises `ValueError` if the body isn't a JSON object with a tracker.
+    """
+    if simdjson is None:
+        return _decode_with_json(body)
+
+    doc = _parser().parse(body)
+    tracker_doc = None
+    try:
+        if not isinstance(doc, simdjson.Object) or not isinstance(doc.get("tracker"), simdjson.Object):
+            raise ValueError("Action call must be a JSON object with a tracker.")
+
+        tracker_doc = doc["tracker"]
+        tracker = {k: _materialize(tracker_doc[k]) for k in TRACKER_FIELDS if k in tracker_doc}
+        call = ActionCall(body, doc.get("next_action"), doc.get("version"), tracker,
+                          _materialize(doc.get("domain")) or {},
+                          trailing_slot_events=_trailing_slot_events(tracker_doc.get("events")))
+    finally:
+        # The parser can't be reused while proxies into the previous document are alive.
+        doc = tracker_doc = None
+
+    return call
+
+
+def _decode_with_json(body: bytes) -> ActionCall:
+    action_call = json.loads(body)
+    if not isinstance(action_call, dict) or not isinstance(action_call.get("tracker"), dict):
+        raise ValueError("Action call must be a JSON object with a tracker.")
+
+    tracker = action_call["tracker"]
+    return ActionCall(body, action_call.get("next_action"), action_call.get("version"),
+                      {k: tracker[k] for k in TRACKER_FIELDS if k in tracker},
+                      action_call.get("domain") or {}, tracker.get("events", []))
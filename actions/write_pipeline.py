@@ -0,0 +1,139 @@
+"""Coalesces claim store writes into micro-batches.
+
+Every payment or new claim used to be its own write (and, against a database, its own commit). The pipeline queues
+writes from all conversations and flushes them together, either once `max_batch_size` writes are waiting or
+`max_delay` seconds after the first one arrived, whichever happens first. Each caller awaits only the result of its own
+write. When the queue is full, callers wait for room before their write is accepted.
+
+The change records of applied writes are published to the change feed, in the order the store applied them. With a
+sink, the pipeline also starts forwarding the feed to it on the same event loop, so the sink runs under
+`rasa run actions` as well as under `actions.server`.
+"""
+import time
+import asyncio
+import logging
+from typing import Text, Any, List, Tuple, Optional
+
+from actions.change_feed import run_sink
+from actions.metrics import REGISTRY
+
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = REGISTRY.histogram("claim_store_write_batch_size", "Number of writes flushed together.",
+                                [1, 2, 5, 10, 25, 50, 100, 250, 500])
+FLUSH_LATENCY = REGISTRY.histogram("claim_store_flush_seconds", "Time taken to apply a batch of writes.",
+                                   [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0])
+WRITE_LATENCY = REGISTRY.histogram("claim_store_write_seconds", "Time from submitting a write until it is applied.",
+                                   [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0])
+QUEUE_DEPTH = REGISTRY.gauge("claim_store_write_queue_depth", "Writes waiting to be flushed.")
+FLUSH_ERRORS = REGISTRY.counter("claim_store_flush_errors_total", "Batches that failed to be applied.")
+
+
+class WritePipeline:
+    """Queues claim store writes and flushes them in bounded batches."""
+
+    def __init__(
+        self,
+        store,
+        max_batch_size: int = 100,
+        max_delay: float = 0.005,
+        max_queue_size: int = 1000,
+        change_feed=None,
+        sink=None,
+    ) -> None:
+        self.store = store
+        self.change_feed = change_feed
+        self.sink = sink
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.max_queue_size = max_queue_size
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._sink_task: Optional[asyncio.Task] = None
+
+    def _ensure_started(self) -> asyncio.Queue:
+        # The queue and the flush task belong to the loop they were created on, which is the worker's loop rather than
+        # whatever loop existed when the actions were imported.
+        loop = asyncio.get_event_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._worker = loop.create_task(self._flush_forever())
+        if self.sink is not None and self.change_feed is not None and \
+                (self._sink_task is None or self._sink_task.get_loop() is not loop):
+            # Started once per loop, before the first write is queued, from where the feed is now, so the sink doesn't
+            # miss a change that is published before the task gets to run.
+            self._sink_task = loop.create_task(run_sink(self.change_feed, self.sink,
+                                                        start_seq=self.change_feed.last_seq))
+        return self._queue
+
+    async def submit(self, op: Text, *args: Any) -> Any:
+        """Queues a claim store write and waits until it has been applied.
+
+        Returns the store method's result, or raises the exception it failed with.
+        """
+        queue = self._ensure_started()
+        future = self._loop.create_future()
+        await queue.put((op, args, future, time.perf_counter()))
+        QUEUE_DEPTH.set(queue.qsize())
+        return await future
+
+    async def _next_batch(self) -> List[Tuple[Text, Tuple, asyncio.Future, float]]:
+        queue = self._queue
+        batch = [await queue.get()]
+        deadline = self._loop.time() + self.max_delay
+
+        while len(batch) < self.max_batch_size:
+            if not queue.empty():
+                batch.append(queue.get_nowait())
+                continue
+
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        QUEUE_DEPTH.set(queue.qsize())
+        return batch
+
+    async def _flush_forever(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Tuple[Text, Tuple, asyncio.Future, float]]) -> None:
+        mutations = [(op, args) for op, args, _, _ in batch]
+        started = time.perf_counter()
+        try:
+            if self.store.blocking:
+                results = await self._loop.run_in_executor(None, self.store.apply_batch, mutations)
+            else:
+                results = self.store.apply_batch(mutations)
+        except Exception as e:
+            logger.exception(f"Failed to write a batch of {len(batch)} changes.")
+            FLUSH_ERRORS.inc()
+            results = [e] * len(batch)
+
+        finished = time.perf_counter()
+        BATCH_SIZE.observe(len(batch))
+        FLUSH_LATENCY.observe(finished - started)
+
+        for (_, _, future, submitted), result in zip(batch, results):
+            WRITE_LATENCY.observe(finished - submitted)
+            if self.change_feed is not None and isinstance(result, dict):
+                try:
+                    self.change_feed.publish(result)
+                except ValueError:
+                    logger.exception("Could not publish a change to the change feed.")
+            if future.done():
+                # The caller stopped waiting, e.g. because its request was cancelled.
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,82 @@
+"""Compares the cost of decoding action calls in full against the partial decoder, by conversation length.
+
+Plain actions only read slots and the latest message. Form validation actions also read the slot events at the end of
+the history, which the partial decoder picks out without decoding the rest.
+
+    python benchmarks/bench_decoding.py
+"""
+import os
+import sys
+import json
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from actions import tracker_decoding  # noqa: E402
+from payloads import action_call, encode, user_turn  # noqa: E402
+
+
+def decode_full(body: bytes) -> None:
+    tracker = json.loads(body)["tracker"]
+    tracker["slots"].get("claim_id")
+
+
+def decode_partial(body: bytes) -> None:
+    tracker_decoding.decode_action_call(body).tracker["slots"].get("claim_id")
+
+
+def decode_partial_with_events(body: bytes) -> None:
+    tracker_decoding.decode_action_call(body).events()
+
+
+def validate_full(body: bytes) -> None:
+    # What `Tracker.slots_to_validate` does with a fully decoded tracker.
+    events = json.loads(body)["tracker"]["events"]
+    start = len(events)
+    while start > 0 and events[start - 1]["event"] == "slot":
+        start -= 1
+    {e["name"]: e["value"] for e in events[start:]}
+
+
+def validate_partial(body: bytes) -> None:
+    {e["name"]: e["value"] for e in tracker_decoding.decode_action_call(body).trailing_slot_events()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, nargs="+", default=[1, 10, 50, 100, 500, 1000])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    if tracker_decoding.simdjson is None:
+        print("pysimdjson is not installed, the partial decoder falls back to json and decodes everything.\n")
+
+    print("Plain action (action_claim_status)")
+    print(f"{'turns':>6} {'body KB':>8} {'full ms':>9} {'partial ms':>11} {'speedup':>8} {'+events ms':>11}")
+    for turns in args.turns:
+        body = encode(action_call("action_claim_status", slots={"claim_id": "AB234567"},
+                                  latest_message=user_turn("check claim AB234567", "claim_status"),
+                                  n_turns=turns))
+        repeat = max(1, args.repeat // max(1, turns // 50))
+        full = timeit.timeit(lambda: decode_full(body), number=repeat) / repeat * 1e3
+        partial = timeit.timeit(lambda: decode_partial(body), number=repeat) / repeat * 1e3
+        with_events = timeit.timeit(lambda: decode_partial_with_events(body), number=repeat) / repeat * 1e3
+        print(f"{turns:>6} {len(body) / 1024:>8.1f} {full:>9.3f} {partial:>11.3f} {full / partial:>7.1f}x "
+              f"{with_events:>11.3f}")
+
+    print("\nForm validation (validate_pay_claim_form, slots to validate)")
+    print(f"{'turns':>6} {'body KB':>8} {'full ms':>9} {'partial ms':>11} {'speedup':>8}")
+    for turns in args.turns:
+        message = user_turn("I want to pay $100", "inform")
+        body = encode(action_call("validate_pay_claim_form", slots={"claim_id": "AB234567"}, latest_message=message,
+                                  n_turns=turns, slot_candidates={"amount-of-money": 100, "claim_pay_amount": 100}))
+        repeat = max(1, args.repeat // max(1, turns // 50))
+        full = timeit.timeit(lambda: validate_full(body), number=repeat) / repeat * 1e3
+        partial = timeit.timeit(lambda: validate_partial(body), number=repeat) / repeat * 1e3
+        print(f"{turns:>6} {len(body) / 1024:>8.1f} {full:>9.3f} {partial:>11.3f} {full / partial:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Checks the accuracy and latency of the in-process amount and number extraction.
+
+Accuracy is measured on benchmarks/number_extraction_cases.yml, and the script fails if any example is wrong. Pass
+`--duckling-url` to time a Duckling server on the same messages for comparison. tests/test_number_extraction.py runs
+the same examples under pytest.
+
+    python benchmarks/bench_number_extraction.py --duckling-url http://localhost:8000
+"""
+import os
+import sys
+import time
+import timeit
+import argparse
+import urllib.parse
+import urllib.request
+from typing import Text, Optional
+
+from ruamel.yaml import YAML
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from actions.number_extraction import parse_amount, parse_integer  # noqa: E402
+
+CASES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "number_extraction_cases.yml")
+
+
+def accuracy(cases, verbose: bool) -> int:
+    """Prints how many examples come out right per section. Returns the number that were wrong."""
+    wrong = 0
+    for section, examples in cases.items():
+        correct = 0
+        for example in examples:
+            amount = parse_amount(example["text"])
+            number = parse_integer(example["text"])
+            if amount == example["amount"] and number == example["number"]:
+                correct += 1
+            elif verbose:
+                print(f"  {example['text']!r}: got amount={amount} number={number}, "
+                      f"expected amount={example['amount']} number={example['number']}")
+        print(f"{section:>9}: {correct}/{len(examples)} correct ({correct / len(examples):.1%})")
+        wrong += len(examples) - correct
+    return wrong
+
+
+def duckling_parse(url: Text, text: Text) -> Optional[bytes]:
+    data = urllib.parse.urlencode({"text": text, "locale": "en_US"}).encode()
+    with urllib.request.urlopen(f"{url.rstrip('/')}/parse", data=data, timeout=5) as response:
+        return response.read()
+
+
+def latency(texts, repeat: int, duckling_url: Optional[Text]) -> None:
+    def run_all():
+        for text in texts:
+            parse_amount(text)
+            parse_integer(text)
+
+    per_message = timeit.timeit(run_all, number=repeat) / (repeat * len(texts))
+    print(f"\nin-process: {per_message * 1e6:.1f} us per message (amount and number)")
+
+    if duckling_url:
+        started = time.perf_counter()
+        for text in texts:
+            duckling_parse(duckling_url, text)
+        per_message = (time.perf_counter() - started) / len(texts)
+        print(f"  duckling: {per_message * 1e6:.1f} us per message")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=1000)
+    parser.add_argument("--duckling-url", default=None)
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show the examples that were wrong.")
+    args = parser.parse_args()
+
+    with open(CASES_FILE, "r") as f:
+        cases = YAML(typ="safe").load(f)
+
+    wrong = accuracy(cases, args.verbose)
+    latency([example["text"] for examples in cases.values() for example in examples], args.repeat, args.duckling_url)
+    if wrong:
+        sys.exit(f"{wrong} examples were wrong.")
+
+
+if __name__ == "__main__":
+    main()
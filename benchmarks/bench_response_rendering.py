@@ -0,0 +1,89 @@
+"""Compares filling in domain responses with precompiled formatters against the per-turn template path.
+
+The template path repeats what Rasa does for every `utter_message(template=...)`: pick a variation, copy it and fill
+in each field with the placeholder regex and `str.format`. The compiled path is `actions.responses.ResponseRenderer`.
+Both are checked to give the same messages before they are timed.
+
+    python benchmarks/bench_response_rendering.py
+"""
+import os
+import sys
+import copy
+import random
+import timeit
+import argparse
+from typing import Dict, Text, Any, List
+
+from ruamel.yaml import YAML
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from actions.responses import INTERPOLATED_KEYS, ResponseRenderer, interpolate  # noqa: E402
+
+DOMAIN_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "domain.yml")
+
+CLAIMS = [
+    {"claim_id": "XX123456", "claim_date": "2020-10-04", "claim_balance": "$0", "claim_status": "Final"},
+    {"claim_id": "AB234567", "claim_date": "2020-03-12", "claim_balance": "$5000", "claim_status": "Pending"},
+    {"claim_id": "Z345678", "claim_date": "2020-11-30", "claim_balance": "$200", "claim_status": "Submitted"},
+    {"claim_id": "C456789", "claim_date": "2020-09-03", "claim_balance": "$500", "claim_status": "Final"},
+    {"claim_id": "CL567890", "claim_date": "2020-02-03", "claim_balance": "$3000", "claim_status": "Pending"},
+]
+
+# The responses the actions send per turn, with their parameters.
+TURNS = {
+    "final quote": [("utter_final_quote", {"final_quote": 200, "insurance_type": "Auto", "quote_state": "MA",
+                                           "n_persons": 2})],
+    "confirm address": [("utter_confirm_address", {"address_street": "7 Maple Ave.", "address_city": "Lynn",
+                                                   "address_state": "MA", "address_zip": "01902",
+                                                   "full_address": "7 Maple Ave.\nLynn, MA 01902"})],
+    "payment": [("utter_claim_payment_success", {"claim_id": "AB234567", "amount_to_pay": 100.0,
+                                                 "claim_balance": 4900.0})],
+    "claim listing": [("utter_claim_detail", c) for c in CLAIMS] + [("utter_scroll_status_prev_next", {})],
+}
+
+
+def template_path(responses: Dict[Text, List[Dict[Text, Any]]], slots: Dict[Text, Any], turn) -> List[Any]:
+    messages = []
+    for name, kwargs in turn:
+        response = copy.deepcopy(random.choice(responses[name]))
+        values = dict(slots)
+        values.update(kwargs)
+        for key in INTERPOLATED_KEYS:
+            if key in response:
+                response[key] = interpolate(response[key], values)
+        messages.append(response)
+    return messages
+
+
+def compiled_path(renderer: ResponseRenderer, slots: Dict[Text, Any], turn) -> List[Any]:
+    return [renderer.render(name, slots, kwargs) for name, kwargs in turn]
+
+
+def main(args=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--domain", default=DOMAIN_FILE, help="Domain file to load the responses from.")
+    parser.add_argument("--number", type=int, default=20000, help="Turns rendered per measurement.")
+    parsed = parser.parse_args(args)
+
+    with open(parsed.domain, "r") as f:
+        domain = YAML(typ="safe").load(f)
+    responses = domain["responses"]
+    renderer = ResponseRenderer(responses)
+    # Trackers carry every slot in the domain, most of them unset.
+    slots = dict.fromkeys(domain.get("slots", {}))
+
+    print(f"{'turn':>16} {'template':>12} {'compiled':>12} {'speedup':>8}")
+    for label, turn in TURNS.items():
+        for expected, message in zip(template_path(responses, slots, turn), compiled_path(renderer, slots, turn)):
+            rendered = {k: message[k] for k in expected}
+            assert rendered == expected, f"{label}: {rendered} != {expected}"
+
+        template = min(timeit.repeat(lambda: template_path(responses, slots, turn), number=parsed.number, repeat=5))
+        compiled = min(timeit.repeat(lambda: compiled_path(renderer, slots, turn), number=parsed.number, repeat=5))
+        print(f"{label:>16} {template / parsed.number * 1e6:>9.1f} us {compiled / parsed.number * 1e6:>9.1f} us "
+              f"{template / compiled:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Measures action server throughput as the number of pre-forked workers grows.
+
+Starts `python -m actions.server` with 1, 2, ... N workers and drives `/webhook` from several client processes over
+keep-alive connections. Run it from the project root:
+
+    python benchmarks/bench_workers.py --max-workers 4 --seconds 10
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+import http.client
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from payloads import action_call, encode, user_turn  # noqa: E402
+
+
+def wait_until_healthy(port: int, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Action server on port {port} did not start.")
+
+
+def client(port: int, body: bytes, seconds: float, results) -> None:
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    headers = {"Content-Type": "application/json"}
+    requests = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        conn.request("POST", "/webhook", body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f"Unexpected status {response.status}")
+        requests += 1
+    results.put(requests)
+
+
+def measure(workers: int, port: int, clients: int, seconds: float, body: bytes) -> float:
+    claim_store = os.path.join(tempfile.mkdtemp(), "claims.db")
+    server = subprocess.Popen([sys.executable, "-m", "actions.server", "--workers", str(workers),
+                               "--port", str(port), "--claim-store", claim_store],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_healthy(port)
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=client, args=(port, body, seconds, results)) for _ in range(clients)]
+        for p in procs:
+            p.start()
+        total = sum(results.get() for _ in procs)
+        for p in procs:
+            p.join()
+        return total / seconds
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--clients", type=int, default=None, help="Client processes. Defaults to 2 x max workers.")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--turns", type=int, default=20, help="Conversation length in the tracker payload.")
+    args = parser.parse_args()
+
+    clients = args.clients or 2 * args.max_workers
+    body = encode(action_call("action_claim_status", slots={"claim_id": "AB234567"},
+                              latest_message=user_turn("check claim AB234567", "claim_status"),
+                              n_turns=args.turns))
+
+    baseline = None
+    print(f"{'workers':>7} {'req/s':>10} {'speedup':>8}")
+    for workers in range(1, args.max_workers + 1):
+        rps = measure(workers, args.port, clients, args.seconds, body)
+        baseline = baseline or rps
+        print(f"{workers:>7} {rps:>10.1f} {rps / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Builds action server webhook payloads that look like the ones Rasa sends."""
+import json
+import time
+from typing import Dict, Text, Any, List, Optional
+
+
+def user_turn(text: Text, intent: Text, entities: Optional[List[Dict[Text, Any]]] = None) -> Dict[Text, Any]:
+    """A parsed user message, as it appears in `latest_message` and in `user` events."""
+    return {
+        "intent": {"name": intent, "confidence": 0.98},
+        "entities": entities or [],
+        "text": text,
+        "message_id": "2c1b8e5a6f3d4c2a9d0e1f2a3b4c5d6e",
+        "metadata": {},
+        "intent_ranking": [{"name": intent, "confidence": 0.98},
+                           {"name": "inform", "confidence": 0.01},
+                           {"name": "affirm", "confidence": 0.01}],
+    }
+
+
+def conversation_events(n_turns: int) -> List[Dict[Text, Any]]:
+    """Events of a conversation of `n_turns` user turns, roughly the shape of a claim payment dialogue."""
+    timestamp = time.time()
+    events = [{"event": "action", "timestamp": timestamp, "name": "action_session_start", "policy": None,
+               "confidence": 1.0},
+              {"event": "session_started", "timestamp": timestamp}]
+    for i in range(n_turns):
+        turn = user_turn(f"I want to pay ${100 + i} on claim AB234567", "make_payment",
+                         [{"entity": "amount-of-money", "start": 14, "end": 18, "value": 100 + i,
+                           "extractor": "DucklingEntityExtractor",
+                           "additional_info": {"value": 100 + i, "unit": "USD", "type": "value"}}])
+        events.extend([
+            {"event": "action", "timestamp": timestamp, "name": "action_listen", "policy": None, "confidence": None},
+            dict(turn, event="user", timestamp=timestamp, input_channel="rest",
+                 parse_data=dict(turn)),
+            {"event": "user_featurization", "timestamp": timestamp, "use_text_for_featurization": False},
+            {"event": "action", "timestamp": timestamp, "name": "pay_claim_form",
+             "policy": "policy_2_RulePolicy", "confidence": 1.0},
+            {"event": "active_loop", "timestamp": timestamp, "name": "pay_claim_form"},
+            {"event": "slot", "timestamp": timestamp, "name": "claim_id", "value": "AB234567"},
+            {"event": "slot", "timestamp": timestamp, "name": "requested_slot", "value": "claim_pay_amount"},
+            {"event": "bot", "timestamp": timestamp, "text": "How much would you like to pay?",
+             "data": {"elements": None, "quick_replies": None, "buttons": None, "attachment": None,
+                      "image": None, "custom": None},
+             "metadata": {"template_name": "utter_ask_claim_pay_amount"}},
+        ])
+    return events
+
+
+def action_call(
+    action_name: Text,
+    slots: Optional[Dict[Text, Any]] = None,
+    latest_message: Optional[Dict[Text, Any]] = None,
+    n_turns: int = 5,
+    domain: Optional[Dict[Text, Any]] = None,
+    sender_id: Text = "benchmark",
+    slot_candidates: Optional[Dict[Text, Any]] = None,
+) -> Dict[Text, Any]:
+    """A full `/webhook` request body for running `action_name`.
+
+    `slot_candidates` are appended as slot events after the latest user message, the way Rasa sends them to a form
+    validation action.
+    """
+    events = conversation_events(n_turns)
+    if slot_candidates is not None:
+        timestamp = time.time()
+        events.extend([
+            {"event": "action", "timestamp": timestamp, "name": "action_listen", "policy": None, "confidence": None},
+            dict(latest_message or user_turn("hello", "greet"), event="user", timestamp=timestamp,
+                 input_channel="rest"),
+            {"event": "user_featurization", "timestamp": timestamp, "use_text_for_featurization": False},
+        ])
+        events.extend({"event": "slot", "timestamp": timestamp, "name": k, "value": v}
+                      for k, v in slot_candidates.items())
+    return {
+        "next_action": action_name,
+        "sender_id": sender_id,
+        "version": "2.8.1",
+        "tracker": {
+            "sender_id": sender_id,
+            "slots": slots or {},
+            "latest_message": latest_message or user_turn("hello", "greet"),
+            "latest_event_time": time.time(),
+            "followup_action": None,
+            "paused": False,
+            "events": events,
+            "latest_input_channel": "rest",
+            "active_loop": {},
+            "latest_action": {"action_name": "action_listen"},
+            "latest_action_name": "action_listen",
+        },
+        "domain": domain or {},
+    }
+
+
+def encode(payload: Dict[Text, Any]) -> bytes:
+    return json.dumps(payload).encode("utf-8")
@@ -0,0 +1,182 @@
+import asyncio
+
+import pytest
+
+from actions.admission import QUEUE_DEPTH, AdmissionController, AdmissionRejected
+
+READ_ACTION = "action_ask_recent_claims"
+WRITE_ACTION = "action_pay_claim"
+
+
+async def hold(controller, action_name, sender_id, release, log=None):
+    """Runs a call that stays admitted until `release` is set."""
+    async with controller.admit(action_name, sender_id):
+        if log is not None:
+            log.append(sender_id)
+        await release.wait()
+
+
+def queue_depth():
+    return QUEUE_DEPTH.value(priority="read"), QUEUE_DEPTH.value(priority="write")
+
+
+def test_writes_are_admitted_before_reads():
+    controller = AdmissionController(max_in_flight=1, max_wait=5)
+    log = []
+
+    async def run():
+        release = asyncio.Event()
+        running = asyncio.ensure_future(hold(controller, READ_ACTION, "first", release))
+        await asyncio.sleep(0)
+        waiting = [asyncio.ensure_future(hold(controller, READ_ACTION, "read", release, log)),
+                   asyncio.ensure_future(hold(controller, WRITE_ACTION, "write", release, log))]
+        await asyncio.sleep(0.01)
+        release.set()
+        await asyncio.gather(running, *waiting)
+
+    asyncio.run(run())
+    assert log == ["write", "read"]
+    assert controller.in_flight == 0
+
+
+def test_calls_of_one_conversation_run_in_order():
+    controller = AdmissionController(max_in_flight=10, max_wait=5)
+    log = []
+
+    async def call(i):
+        async with controller.admit(READ_ACTION, "sender"):
+            log.append(("start", i))
+            await asyncio.sleep(0.01)
+            log.append(("end", i))
+
+    async def run():
+        await asyncio.gather(*[call(i) for i in range(3)])
+
+    asyncio.run(run())
+    assert log == [("start", 0), ("end", 0), ("start", 1), ("end", 1), ("start", 2), ("end", 2)]
+    assert controller._conversations == {}
+
+
+def test_too_many_calls_for_a_conversation_get_429():
+    controller = AdmissionController(max_conversation_queue=1, max_wait=5, retry_after=3)
+
+    async def run():
+        release = asyncio.Event()
+        running = asyncio.ensure_future(hold(controller, READ_ACTION, "sender", release))
+        await asyncio.sleep(0)
+        waiting = asyncio.ensure_future(hold(controller, READ_ACTION, "sender", release))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await hold(controller, READ_ACTION, "sender", release)
+        release.set()
+        await asyncio.gather(running, waiting)
+        return rejected.value
+
+    rejected = asyncio.run(run())
+    assert (rejected.status, rejected.reason, rejected.retry_after) == (429, "conversation_queue_full", 3)
+
+
+def test_waiting_too_long_for_a_conversation_gets_429():
+    controller = AdmissionController(max_wait=0.02)
+
+    async def run():
+        release = asyncio.Event()
+        running = asyncio.ensure_future(hold(controller, READ_ACTION, "sender", release))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await hold(controller, READ_ACTION, "sender", release)
+        release.set()
+        await running
+        return rejected.value
+
+    rejected = asyncio.run(run())
+    assert (rejected.status, rejected.reason) == (429, "conversation_wait_timeout")
+    assert controller._conversations == {}
+
+
+def test_a_full_queue_gets_503():
+    controller = AdmissionController(max_in_flight=1, max_queue=1, max_wait=5, retry_after=2)
+
+    async def run():
+        release = asyncio.Event()
+        running = asyncio.ensure_future(hold(controller, READ_ACTION, "a", release))
+        await asyncio.sleep(0)
+        waiting = asyncio.ensure_future(hold(controller, READ_ACTION, "b", release))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await hold(controller, READ_ACTION, "c", release)
+        release.set()
+        await asyncio.gather(running, waiting)
+        return rejected.value
+
+    rejected = asyncio.run(run())
+    assert (rejected.status, rejected.reason, rejected.retry_after) == (503, "queue_full", 2)
+    assert controller.in_flight == 0
+
+
+def test_waiting_too_long_for_a_slot_gets_503():
+    controller = AdmissionController(max_in_flight=1, max_wait=0.02)
+    depth = queue_depth()
+
+    async def run():
+        release = asyncio.Event()
+        running = asyncio.ensure_future(hold(controller, READ_ACTION, "a", release))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await hold(controller, READ_ACTION, "b", release)
+        release.set()
+        await running
+        return rejected.value
+
+    rejected = asyncio.run(run())
+    assert (rejected.status, rejected.reason) == (503, "wait_timeout")
+    assert controller.in_flight == 0
+    assert controller._queue == []
+    assert queue_depth() == depth
+
+
+def test_a_cancelled_waiter_leaves_nothing_behind():
+    controller = AdmissionController(max_in_flight=1, max_wait=5)
+    depth = queue_depth()
+
+    async def run():
+        release = asyncio.Event()
+        running = asyncio.ensure_future(hold(controller, READ_ACTION, "a", release))
+        await asyncio.sleep(0)
+        # One waits for a slot, the other for its conversation.
+        for_slot = asyncio.ensure_future(hold(controller, READ_ACTION, "b", release))
+        for_conversation = asyncio.ensure_future(hold(controller, READ_ACTION, "a", release))
+        await asyncio.sleep(0.01)
+        assert queue_depth() != depth
+        for_slot.cancel()
+        for_conversation.cancel()
+        await asyncio.gather(for_slot, for_conversation, return_exceptions=True)
+        assert queue_depth() == depth
+        release.set()
+        await running
+
+    asyncio.run(run())
+    assert controller.in_flight == 0
+    assert controller._queue == []
+    assert controller._conversations == {}
+
+
+def test_a_waiter_cancelled_after_being_handed_a_slot_releases_it():
+    controller = AdmissionController(max_in_flight=1, max_wait=5)
+
+    async def run():
+        release_running, release_waiting = asyncio.Event(), asyncio.Event()
+        running = asyncio.ensure_future(hold(controller, READ_ACTION, "a", release_running))
+        await asyncio.sleep(0)
+        waiting = asyncio.ensure_future(hold(controller, READ_ACTION, "b", release_waiting))
+        await asyncio.sleep(0.01)
+        # The running call hands its slot to the waiter, which is cancelled before it gets to run.
+        release_running.set()
+        await asyncio.sleep(0)
+        assert running.done() and controller.in_flight == 1 and controller._queue == []
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+
+    asyncio.run(run())
+    assert controller.in_flight == 0
+    assert controller._conversations == {}
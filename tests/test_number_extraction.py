@@ -0,0 +1,18 @@
+import os
+
+import pytest
+from ruamel.yaml import YAML
+
+from actions.number_extraction import parse_amount, parse_integer
+
+CASES_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks",
+                          "number_extraction_cases.yml")
+
+with open(CASES_FILE, "r") as f:
+    CASES = [example for examples in YAML(typ="safe").load(f).values() for example in examples]
+
+
+@pytest.mark.parametrize("example", CASES, ids=[example["text"] for example in CASES])
+def test_number_extraction(example):
+    assert parse_amount(example["text"]) == example["amount"]
+    assert parse_integer(example["text"]) == example["number"]
@@ -0,0 +1,172 @@
+import os
+import json
+import copy
+import asyncio
+import threading
+
+import pytest
+
+from actions.change_feed import ChangeFeed
+from actions.claim_store import ClaimExists, InMemoryClaimStore, SQLiteClaimStore
+from actions.write_pipeline import WritePipeline
+
+MOCK_DATA_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "actions", "mock_data.json")
+
+with open(MOCK_DATA_FILE, "r") as f:
+    MOCK_DATA = json.load(f)
+
+
+def new_claim(claim_id, claim_balance=100):
+    return {"claim_id": claim_id, "claim_date": 20210401, "claim_balance": claim_balance, "claim_status": "Pending"}
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        yield InMemoryClaimStore(copy.deepcopy(MOCK_DATA))
+        return
+    store = SQLiteClaimStore(str(tmp_path / "claims.db"))
+    store.initialize(MOCK_DATA)
+    yield store
+    store.close()
+
+
+class RecordingStore(InMemoryClaimStore):
+    """Remembers the size of every batch it applied."""
+
+    def __init__(self) -> None:
+        super().__init__(copy.deepcopy(MOCK_DATA))
+        self.batches = []
+
+    def apply_batch(self, mutations):
+        self.batches.append(len(mutations))
+        return super().apply_batch(mutations)
+
+
+class BlockingStore(RecordingStore):
+    """Applies batches in the executor, and only once `release` is set."""
+
+    blocking = True
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.release = threading.Event()
+
+    def apply_batch(self, mutations):
+        self.release.wait(5)
+        return super().apply_batch(mutations)
+
+
+def test_flushes_when_the_batch_is_full():
+    store = RecordingStore()
+    pipeline = WritePipeline(store, max_batch_size=3, max_delay=10)
+
+    async def run():
+        return await asyncio.wait_for(asyncio.gather(
+            *[pipeline.submit("update_claim_balance", "AB234567", i) for i in range(6)]), 1)
+
+    results = asyncio.run(run())
+    assert store.batches == [3, 3]
+    assert [r["data"]["claim_balance"] for r in results] == list(range(6))
+
+
+def test_flushes_after_the_delay():
+    store = RecordingStore()
+    pipeline = WritePipeline(store, max_batch_size=100, max_delay=0.05)
+
+    async def run():
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        first = asyncio.ensure_future(pipeline.submit("update_claim_balance", "AB234567", 1))
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(pipeline.submit("update_claim_balance", "Z345678", 2))
+        await asyncio.gather(first, second)
+        waited = loop.time() - started
+        await pipeline.submit("update_claim_balance", "AB234567", 3)
+        return waited
+
+    waited = asyncio.run(run())
+    assert store.batches == [2, 1]
+    assert 0.04 <= waited < 1
+
+
+def test_waits_for_room_when_the_queue_is_full():
+    store = BlockingStore()
+    pipeline = WritePipeline(store, max_batch_size=1, max_delay=0, max_queue_size=2)
+
+    async def run():
+        tasks = [asyncio.ensure_future(pipeline.submit("update_claim_balance", "AB234567", i)) for i in range(4)]
+        await asyncio.sleep(0.05)
+        # One write is being applied and two fill the queue, so the last one can't be queued yet.
+        assert pipeline._queue.qsize() == 2
+        assert all(not t.done() for t in tasks)
+        store.release.set()
+        return await asyncio.wait_for(asyncio.gather(*tasks), 5)
+
+    results = asyncio.run(run())
+    assert [r["data"]["claim_balance"] for r in results] == [0, 1, 2, 3]
+    assert store.batches == [1, 1, 1, 1]
+
+
+def test_a_failed_write_only_fails_its_own_caller(store):
+    feed = ChangeFeed()
+    feed.start_at(store.last_seq)
+    pipeline = WritePipeline(store, max_batch_size=10, max_delay=0.01, change_feed=feed)
+
+    async def run():
+        return await asyncio.gather(
+            pipeline.submit("update_claim_balance", "AB234567", 10),
+            pipeline.submit("add_claim", new_claim("AB234567")),
+            pipeline.submit("add_claim", new_claim("NC123456")),
+            return_exceptions=True,
+        )
+
+    updated, duplicate, added = asyncio.run(run())
+    assert isinstance(duplicate, ClaimExists)
+    assert updated["data"]["claim_balance"] == 10
+    assert added["claim_id"] == "NC123456"
+    assert store.get_claim("NC123456") is not None
+    assert [c["seq"] for c in feed.changes_since(0)] == [updated["seq"], added["seq"]]
+
+
+def test_a_cancelled_caller_does_not_break_the_batch(store):
+    pipeline = WritePipeline(store, max_batch_size=10, max_delay=0.05)
+
+    async def run():
+        cancelled = asyncio.ensure_future(pipeline.submit("update_claim_balance", "AB234567", 10))
+        other = asyncio.ensure_future(pipeline.submit("update_claim_balance", "Z345678", 20))
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        result = await other
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        # The pipeline keeps working after a caller went away.
+        await pipeline.submit("update_claim_balance", "C456789", 30)
+        return result
+
+    result = asyncio.run(run())
+    assert result["data"]["claim_balance"] == 20
+    # The write was already queued, so it is still applied.
+    assert store.get_claim("AB234567")["claim_balance"] == 10
+    assert store.get_claim("C456789")["claim_balance"] == 30
+
+
+def test_sqlite_rolls_back_a_failed_mutation_to_its_savepoint(tmp_path):
+    store = SQLiteClaimStore(str(tmp_path / "claims.db"))
+    store.initialize(MOCK_DATA)
+    seq = store.last_seq
+
+    # The second claim fails on the NOT NULL constraint after it took a sequence number.
+    results = store.apply_batch([
+        ("update_claim_balance", ("AB234567", 10)),
+        ("add_claim", (dict(new_claim("NC000001"), claim_status=None),)),
+        ("add_claim", (new_claim("NC000002"),)),
+    ])
+
+    assert isinstance(results[1], Exception)
+    assert [results[0]["seq"], results[2]["seq"]] == [seq + 1, seq + 2]
+    assert store.last_seq == seq + 2
+    assert store.get_claim("NC000001") is None
+    assert store.get_claim("NC000002") is not None
+    assert store.get_claim("AB234567")["claim_balance"] == 10
+    store.close()